@@ -0,0 +1,383 @@
+"""
+Time and peak memory of the fold preprocessing of k_fold, fold by fold.
+
+    python benchmark_folds.py --splits 5 --enc count --outliers
+    python benchmark_folds.py --baseline --pipeline-dir ../old_pipeline
+    python benchmark_folds.py --synthetic 100000 --splits 3
+
+Each fold fits the preprocessor on its training rows and transforms its validation rows and
+the test data, as run_fold does. --baseline runs the inline preprocessing k_fold had before
+ClaimsPreprocessor instead. To compare with another version of the code, put its pipeline.py
+and utils2.py in a directory and pass it with --pipeline-dir (e.g. the utils2.py of the first
+commit with --baseline, for the original preprocessing). Time and peak memory are measured in
+separate passes (tracemalloc slows the code down). Without the claims data, --synthetic
+benchmarks random claims with the columns of train_data_EDA.
+"""
+
+import argparse
+import sys
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import StratifiedKFold
+
+
+def pipeline_fold(X_train, X_val, y_train, test1, enc = 'count', outliers = False, compact = False):
+
+    """
+    Inputs:
+        X_train, X_val, y_train: training and validation rows of the fold
+        test1: test data
+        enc, outliers, compact: preprocessing settings (see k_fold)
+
+    Output: treated training, validation and test data of the fold, with ClaimsPreprocessor
+    """
+
+    from pipeline import ClaimsPreprocessor
+
+    kwargs = {'enc': enc, 'outliers': outliers}
+    if compact:
+        kwargs['compact'] = True
+
+    preprocessor = ClaimsPreprocessor(**kwargs)
+    X_train_RS, y_train = preprocessor.fit_transform(X_train, y_train, carrier_reference = test1)
+    X_val_RS, test_RS = preprocessor.transform(X_val, test1)
+
+    return X_train_RS, y_train, X_val_RS, test_RS
+
+
+def baseline_fold(X_train, X_val, y_train, test1, enc = 'count', outliers = False, compact = False):
+
+    """
+    Inputs:
+        X_train, X_val, y_train: training and validation rows of the fold
+        test1: test data
+        enc, outliers: preprocessing settings (see k_fold)
+        compact: not available in the original preprocessing (ignored)
+
+    Output: treated training, validation and test data of the fold, with the inline
+            preprocessing k_fold had before ClaimsPreprocessor
+    """
+
+    import utils2 as p
+    from sklearn.preprocessing import RobustScaler
+
+    test = test1.copy()
+
+    # ENCODING
+    X_train['Alternative Dispute Resolution Enc'] = X_train['Alternative Dispute Resolution'].replace({'N': 0, 'Y': 1, 'U': 1})
+    X_val['Alternative Dispute Resolution Enc'] = X_val['Alternative Dispute Resolution'].replace({'N': 0, 'Y': 1, 'U': 1})
+    test['Alternative Dispute Resolution Enc'] = test['Alternative Dispute Resolution'].replace({'N': 0, 'Y': 1, 'U': 1})
+
+    X_train['Attorney/Representative Enc'] = X_train['Attorney/Representative'].replace({'N': 0, 'Y': 1})
+    X_val['Attorney/Representative Enc'] = X_val['Attorney/Representative'].replace({'N': 0, 'Y': 1})
+    test['Attorney/Representative Enc'] = test['Attorney/Representative'].replace({'N': 0, 'Y': 1})
+
+    train_carriers = set(X_train['Carrier Name'].unique())
+    test_carriers = set(test['Carrier Name'].unique())
+    common_categories = train_carriers.intersection(test_carriers)
+    common_category_map = {category: idx + 1 for idx,
+                       category in enumerate(common_categories)}
+
+    X_train['Carrier Name Enc'] = X_train['Carrier Name'].map(common_category_map).fillna(0).astype(int)
+    X_val['Carrier Name Enc'] = X_val['Carrier Name'].map(common_category_map).fillna(0).astype(int)
+    test['Carrier Name Enc'] = test['Carrier Name'].map(common_category_map).fillna(0).astype(int)
+
+    X_train, X_val, test = p.encode(X_train, X_val, test, 'Carrier Name Enc', enc)
+
+    X_train, X_val, test = p.encode(X_train, X_val, test, 'Carrier Type', enc)
+    X_train, X_val, test = p.encode(X_train, X_val, test, 'Carrier Type', 'OHE')
+
+    X_train, X_val, test = p.encode(X_train, X_val, test, 'County of Injury', enc)
+
+    X_train['COVID-19 Indicator Enc'] = X_train['COVID-19 Indicator'].replace({'N': 0, 'Y': 1})
+    X_val['COVID-19 Indicator Enc'] = X_val['COVID-19 Indicator'].replace({'N': 0, 'Y': 1})
+    test['COVID-19 Indicator Enc'] = test['COVID-19 Indicator'].replace({'N': 0, 'Y': 1})
+
+    X_train, X_val, test = p.encode(X_train, X_val, test, 'District Name', enc)
+
+    X_train, X_val, test = p.encode(X_train, X_val, test, 'Gender', 'OHE')
+
+    X_train, X_val, test = p.encode(X_train, X_val, test, 'Medical Fee Region', enc)
+
+    X_train, X_val, test = p.encode(X_train, X_val, test, 'Industry Sector', enc)
+
+    drop = ['Alternative Dispute Resolution', 'Attorney/Representative', 'Carrier Type', 'County of Injury',
+            'COVID-19 Indicator', 'District Name', 'Gender', 'Carrier Name',
+            'Medical Fee Region', 'Industry Sector']
+
+    X_train.drop(columns = drop, axis = 1, inplace = True)
+    X_val.drop(columns = drop, axis = 1, inplace = True)
+    test.drop(columns = drop, axis = 1, inplace = True)
+
+    # MISSING VALUES
+    X_train['C-3 Date Binary'] = X_train['C-3 Date'].notna().astype(int)
+    X_val['C-3 Date Binary'] = X_val['C-3 Date'].notna().astype(int)
+    test['C-3 Date Binary'] = test['C-3 Date'].notna().astype(int)
+
+    X_train['First Hearing Date Binary'] = X_train['First Hearing Date'].notna().astype(int)
+    X_val['First Hearing Date Binary'] = X_val['First Hearing Date'].notna().astype(int)
+    test['First Hearing Date Binary'] = test['First Hearing Date'].notna().astype(int)
+
+    drop = ['C-3 Date', 'First Hearing Date']
+    X_train.drop(columns = drop, axis = 1, inplace = True)
+    X_val.drop(columns = drop, axis = 1, inplace = True)
+    test.drop(columns = drop, axis = 1, inplace = True)
+
+    X_train['IME-4 Count'] = X_train['IME-4 Count'].fillna(0)
+    X_val['IME-4 Count'] = X_val['IME-4 Count'].fillna(0)
+    test['IME-4 Count'] = test['IME-4 Count'].fillna(0)
+
+    X_train['Industry Code'] = X_train['Industry Code'].fillna(0)
+    X_val['Industry Code'] = X_val['Industry Code'].fillna(0)
+    test['Industry Code'] = test['Industry Code'].fillna(0)
+
+    p.fill_dates(X_train, [X_val, test], 'Accident Date')
+    p.fill_dates(X_train, [X_val, test], 'C-2 Date')
+
+    p.fill_dow([X_train, X_val, test], 'Accident Date')
+    p.fill_dow([X_train, X_val, test], 'C-2 Date')
+
+    times = ['Accident to Assembly Time', 'Assembly to C-2 Time', 'Accident to C-2 Time']
+    X_train = p.fill_missing_times(X_train, times)
+    X_val = p.fill_missing_times(X_val, times)
+    test = p.fill_missing_times(test, times)
+
+    p.fill_birth_year([X_train, X_val, test])
+
+    # Variables
+    num = ['Age at Injury', 'Average Weekly Wage', 'Birth Year',
+       'IME-4 Count', 'Number of Dependents', 'Accident Date Year',
+       'Accident Date Month', 'Accident Date Day',
+       'Assembly Date Year', 'Assembly Date Month',
+       'Assembly Date Day', 'C-2 Date Year', 'C-2 Date Month',
+       'C-2 Date Day', 'Accident to Assembly Time',
+       'Assembly to C-2 Time', 'Accident to C-2 Time']
+
+    categ = [var for var in X_train.columns if var not in num]
+
+    categ_count_encoding = ['Carrier Name Enc', 'Carrier Type Enc',
+                            'County of Injury Enc', 'District Name Enc',
+                            'Medical Fee Region Enc',
+                            'Industry Sector Enc']
+
+    categ_label_bin = [var for var in X_train.columns if var
+                       in categ and var not in categ_count_encoding]
+
+    num_count_enc = num + categ_count_encoding
+
+    # Scale
+    robust = RobustScaler()
+
+    X_train_num_count_enc_RS = robust.fit_transform(X_train[num_count_enc])
+    X_train_num_count_enc_RS = pd.DataFrame(X_train_num_count_enc_RS, columns=num_count_enc, index=X_train.index)
+    X_val_num_count_enc_RS = robust.transform(X_val[num_count_enc])
+    X_val_num_count_enc_RS = pd.DataFrame(X_val_num_count_enc_RS, columns=num_count_enc, index=X_val.index)
+    test_num_count_enc_RS = robust.transform(test[num_count_enc])
+    test_num_count_enc_RS = pd.DataFrame(test_num_count_enc_RS, columns=num_count_enc, index=test.index)
+
+    X_train_RS = pd.concat([X_train_num_count_enc_RS,
+                            X_train[categ_label_bin]], axis=1)
+    X_val_RS = pd.concat([X_val_num_count_enc_RS,
+                          X_val[categ_label_bin]], axis=1)
+    test_RS = pd.concat([test_num_count_enc_RS,
+                         test[categ_label_bin]], axis=1)
+
+    p.ball_tree_impute([X_train_RS, X_val_RS, test_RS],
+                       'Average Weekly Wage')
+
+    if outliers:
+        X_train_RS = X_train_RS[X_train_RS['Age at Injury'] < 2.0217391304347827]
+
+        X_train_RS['Average Weekly Wage Sqrt'] = np.sqrt(X_train_RS['Average Weekly Wage'])
+        X_val_RS['Average Weekly Wage Sqrt'] = np.sqrt(X_val_RS['Average Weekly Wage'])
+        test_RS['Average Weekly Wage Sqrt'] = np.sqrt(test_RS['Average Weekly Wage'])
+
+        upper_limit = X_train_RS['Average Weekly Wage'].quantile(0.99)
+        lower_limit = X_train_RS['Average Weekly Wage'].quantile(0.01)
+
+        X_train_RS['Average Weekly Wage'] = X_train_RS['Average Weekly Wage'].clip(lower = lower_limit
+                                                              , upper=upper_limit)
+
+        X_train_RS = X_train_RS[X_train_RS['Birth Year'] > -1.9782608695652173]
+
+        X_train_RS['IME-4 Count Log'] = np.log1p(X_train_RS['IME-4 Count'])
+        X_train_RS['IME-4 Count Double Log'] = np.log1p(X_train_RS['IME-4 Count Log'])
+
+        X_val_RS['IME-4 Count Log'] = np.log1p(X_val_RS['IME-4 Count'])
+        X_val_RS['IME-4 Count Double Log'] = np.log1p(X_val_RS['IME-4 Count Log'])
+
+        test_RS['IME-4 Count Log'] = np.log1p(test_RS['IME-4 Count'])
+        test_RS['IME-4 Count Double Log'] = np.log1p(test_RS['IME-4 Count Log'])
+
+        X_train_RS = X_train_RS[X_train_RS['Accident Date Year'] > -2.0]
+
+        X_train_RS = X_train_RS[X_train_RS['C-2 Date Year'] > -2.0]
+
+        y_train = y_train[X_train_RS.index]
+
+    return X_train_RS, y_train, X_val_RS, test_RS
+
+
+def synthetic_claims(n_rows, n_test = None, random_state = 42):
+
+    """
+    Inputs:
+        n_rows: number of training claims
+        n_test: number of test claims (a fifth of n_rows if None)
+        random_state: random_state parameter
+
+    Output: random training claims (with Claim Injury Type) and test claims, with the columns
+            and missing values of train_data_EDA and test_data_EDA
+    """
+
+    rng = np.random.default_rng(random_state)
+
+    def claims(n, carriers):
+        accident = pd.Timestamp('2018-01-01') + pd.to_timedelta(rng.integers(0, 4 * 365, n), unit='D')
+        assembly = accident + pd.to_timedelta(rng.exponential(60, n).astype(int), unit='D')
+        c2 = accident + pd.to_timedelta(rng.exponential(30, n).astype(int), unit='D')
+        age = rng.integers(16, 80, n).astype(float)
+
+        def missing(values, share):
+            values = np.asarray(values, dtype=np.float64).copy()
+            values[rng.random(n) < share] = np.nan
+            return values
+
+        def hearing(share):
+            dates = (accident + pd.to_timedelta(rng.integers(30, 400, n), unit='D')).strftime('%Y-%m-%d')
+            return np.where(rng.random(n) < share, None, dates)
+
+        df = pd.DataFrame({
+            'Age at Injury': age,
+            'Alternative Dispute Resolution': rng.choice(['N', 'Y', 'U'], n, p=[0.99, 0.008, 0.002]),
+            'Attorney/Representative': rng.choice(['N', 'Y'], n, p=[0.7, 0.3]),
+            'Average Weekly Wage': missing(rng.lognormal(6.5, 1.0, n) * (rng.random(n) > 0.4), 0.05),
+            'Birth Year': missing(accident.year - age, 0.05),
+            'C-3 Date': hearing(0.7),
+            'Carrier Name': rng.choice(carriers, n, p=1 / np.arange(1, len(carriers) + 1)
+                                       / (1 / np.arange(1, len(carriers) + 1)).sum()),
+            'Carrier Type': rng.choice(['1A. PRIVATE', '2A. SIF', '3A. SELF PUBLIC', '4A. SELF PRIVATE',
+                                        '5. SPECIAL FUND OR UNKNOWN'], n, p=[0.5, 0.2, 0.15, 0.14, 0.01]),
+            'County of Injury': rng.choice([f'COUNTY {i}' for i in range(62)], n),
+            'COVID-19 Indicator': rng.choice(['N', 'Y'], n, p=[0.95, 0.05]),
+            'District Name': rng.choice(['NYC', 'ALBANY', 'HAUPPAUGE', 'BUFFALO', 'SYRACUSE',
+                                         'ROCHESTER', 'BINGHAMTON', 'STATEWIDE'], n),
+            'First Hearing Date': hearing(0.75),
+            'Gender': rng.choice(['M', 'F', 'U', 'X'], n, p=[0.55, 0.44, 0.009, 0.001]),
+            'IME-4 Count': missing(rng.integers(1, 10, n), 0.77),
+            'Industry Code': missing(rng.choice([23, 44, 48, 56, 61, 62, 72, 92], n), 0.02),
+            'Medical Fee Region': rng.choice(['I', 'II', 'III', 'IV', 'UK'], n),
+            'WCIO Cause of Injury Code': rng.integers(1, 100, n),
+            'WCIO Nature of Injury Code': rng.integers(1, 92, n),
+            'WCIO Part Of Body Code': rng.integers(-9, 92, n),
+            'Number of Dependents': rng.integers(0, 7, n),
+            'Industry Sector': rng.choice([f'SECTOR {i}' for i in range(10)], n)
+        }, index=pd.Index(rng.permutation(10 * n)[:n] + 5000000, name='Claim Identifier'))
+
+        for prefix, dates, share in [('Accident Date', accident, 0.01), ('Assembly Date', assembly, 0),
+                                     ('C-2 Date', c2, 0.03)]:
+            # Integer columns when nothing is missing, as read_csv gives them
+            known = rng.random(n) >= share
+            for part, values in [('Year', dates.year), ('Month', dates.month), ('Day', dates.day),
+                                 ('Day of Week', dates.dayofweek)]:
+                df[f'{prefix} {part}'] = values.to_numpy() if known.all() else np.where(known, values, np.nan)
+
+        df['Accident to Assembly Time'] = missing((assembly - accident).days, 0.01)
+        df['Assembly to C-2 Time'] = missing((assembly - c2).days, 0.03)
+        df['Accident to C-2 Time'] = missing((c2 - accident).days, 0.03)
+
+        # Missing parts give missing intervals
+        df.loc[df['Accident Date Year'].isna(), ['Accident to Assembly Time', 'Accident to C-2 Time']] = np.nan
+        df.loc[df['C-2 Date Year'].isna(), ['Assembly to C-2 Time', 'Accident to C-2 Time']] = np.nan
+
+        return df
+
+    carriers = np.array([f'CARRIER {i}' for i in range(2000)])
+
+    train = claims(n_rows, carriers)
+    train['Claim Injury Type'] = rng.choice(8, n_rows, p=[0.02, 0.5, 0.12, 0.26, 0.08, 0.015, 0.001, 0.004])
+
+    # Most test carriers are known, a few are new
+    test_carriers = np.concatenate([carriers[:1800], [f'NEW CARRIER {i}' for i in range(200)]])
+    test1 = claims(n_test or n_rows // 5, test_carriers)
+
+    return train, test1
+
+
+def benchmark_folds(X, y, test1, method, enc = 'count', outliers = False, compact = False, baseline = False):
+
+    """
+    Inputs:
+        X, y: all data but target and target
+        test1: test data
+        method: k-fold method
+        enc, outliers, compact: preprocessing settings (see k_fold)
+        baseline: True for the original inline preprocessing (see baseline_fold)
+
+    Output: dataframe with the time (seconds) and peak memory (MB) of each fold
+    """
+
+    preprocess = baseline_fold if baseline else pipeline_fold
+
+    def run(train_index, val_index):
+        # Copies, as the original preprocessing modifies its inputs
+        X_train, X_val = X.iloc[train_index].copy(), X.iloc[val_index].copy()
+        return preprocess(X_train, X_val, y.iloc[train_index], test1, enc, outliers, compact)
+
+    records = []
+    for fold, (train_index, val_index) in enumerate(method.split(X, y)):
+        start_time = time.perf_counter()
+        run(train_index, val_index)
+        elapsed_time = time.perf_counter() - start_time
+
+        # Peak memory in a second pass
+        tracemalloc.start()
+        run(train_index, val_index)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        records.append({'fold': fold + 1,
+                        'seconds': round(elapsed_time, 2),
+                        'peak_mb': round(peak / 1024 ** 2, 1)})
+
+    return pd.DataFrame(records).set_index('fold')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Time and peak memory of the fold preprocessing')
+    parser.add_argument('--train', default='./data/train_data_EDA.csv', help='path to train_data_EDA.csv')
+    parser.add_argument('--test', default='./data/test_data_EDA.csv', help='path to test_data_EDA.csv')
+    parser.add_argument('--splits', type=int, default=5, help='number of folds')
+    parser.add_argument('--enc', default='count', choices=['count', 'freq'])
+    parser.add_argument('--outliers', action='store_true', help='treat outliers')
+    parser.add_argument('--compact', action='store_true', help='compact dtypes')
+    parser.add_argument('--baseline', action='store_true', help='original inline preprocessing of k_fold')
+    parser.add_argument('--pipeline-dir', default=None, help='directory of the pipeline.py and utils2.py to benchmark')
+    parser.add_argument('--synthetic', type=int, default=None, help='rows of synthetic claims instead of the claims')
+    args = parser.parse_args()
+
+    if args.pipeline_dir is not None:
+        sys.path.insert(0, args.pipeline_dir)
+
+    # The original preprocessing assigns to slices and fills in place
+    warnings.simplefilter('ignore')
+
+    if args.synthetic is not None:
+        df, test1 = synthetic_claims(args.synthetic)
+    else:
+        df = pd.read_csv(args.train, index_col = 'Claim Identifier')
+        test1 = pd.read_csv(args.test, index_col = 'Claim Identifier')
+
+    X = df.drop('Claim Injury Type', axis=1)
+    y = df['Claim Injury Type']
+
+    method = StratifiedKFold(n_splits=args.splits, shuffle=True, random_state=42)
+
+    report = benchmark_folds(X, y, test1, method, args.enc, args.outliers, args.compact, args.baseline)
+    print(report)
+    print(f"Mean: {report['seconds'].mean():.2f} seconds, {report['peak_mb'].mean():.1f} MB peak per fold")
@@ -0,0 +1,182 @@
+"""
+Recall and speed of the neighbour backends of the Average Weekly Wage imputer, against the
+exact ball tree.
+
+    python benchmark_imputer.py --neighbors 5 --queries 20000
+    python benchmark_imputer.py --tables 4 8 16 --components 4 8
+    python benchmark_imputer.py --synthetic 50000 --latent 5
+
+The preprocessor is fitted on the training rows of one split, and its scaled features are
+used as the imputer sees them. The validation rows with a known wage are the queries, so
+each backend is compared with the exact neighbours (recall@k) and with the exact imputed
+wage (mean absolute difference). Time and peak memory of the queries are measured in separate
+passes (tracemalloc slows the code down). Without the claims data, --synthetic benchmarks
+heavy-tailed features of the same shape (--latent for features driven by a few latent factors,
+as correlated claim features are).
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+
+import utils2 as p
+from pipeline import ClaimsPreprocessor
+
+
+def scaled_features(X, y, enc = 'count', random_state = 42):
+
+    """
+    Inputs:
+        X, y: all data but target and target
+        enc: type of encoding to be used
+        random_state: random_state parameter
+
+    Output: features and wage of the training rows and of the validation rows with a known
+            wage, and the names of the features
+    """
+
+    X_train, X_val, y_train, _ = train_test_split(X, y, test_size = 0.2, stratify = y,
+                                                  random_state = random_state)
+
+    preprocessor = ClaimsPreprocessor(enc = enc).fit(X_train)
+
+    # Scaled features before the imputation (the imputer leaves out the rows without a wage)
+    train_columns = preprocessor._scale(preprocessor._encode(X_train))
+    val_columns = preprocessor._scale(preprocessor._encode(X_val))
+
+    target = preprocessor.target
+    features = preprocessor.impute_features
+    known = ~np.isnan(np.asarray(val_columns[target], dtype=np.float64))
+
+    return (preprocessor._feature_matrix(train_columns, slice(None)),
+            np.asarray(train_columns[target], dtype=np.float64),
+            preprocessor._feature_matrix(val_columns, known), features)
+
+
+def synthetic_features(n_rows, n_features = 40, n_latent = None, n_queries = 20000, random_state = 42):
+
+    """
+    Inputs:
+        n_rows: number of training rows
+        n_features: number of features
+        n_latent: number of latent factors behind the features (None for independent features)
+        n_queries: number of rows to impute
+        random_state: random_state parameter
+
+    Output: heavy-tailed (Student t, 2 degrees of freedom) features and wage of the training rows,
+            features of the rows to impute, and the names of the features
+    """
+
+    rng = np.random.default_rng(random_state)
+
+    def features(n):
+        if n_latent is None:
+            return rng.standard_t(2, size=(n, n_features))
+        return rng.standard_t(2, size=(n, n_latent)) @ loadings + 0.1 * rng.standard_normal((n, n_features))
+
+    loadings = rng.standard_normal((n_latent or 1, n_features))
+
+    X_train = features(n_rows)
+    y_train = np.exp(6 + X_train[:, :3].sum(axis=1) / 10 + rng.standard_normal(n_rows))
+
+    return X_train, y_train, features(n_queries), [f'feature {i}' for i in range(n_features)]
+
+
+def benchmark_imputer(X_train, y_train, queries, configs, n_neighbors = 5):
+
+    """
+    Inputs:
+        X_train, y_train: features and wage of the training rows
+        queries: features of the rows to impute
+        configs: dictionary with the name and BallTreeImputer parameters of each backend
+                 ('columns' for the positions of a subset of the features)
+        n_neighbors: number of neighbours
+
+    Output: dataframe with the build and query time, peak memory of the queries, recall@k and
+            mean absolute difference of the imputed wage of each backend, against the exact ball tree
+    """
+
+    exact = p.BallTreeImputer(n_neighbors = n_neighbors).fit(X_train, y_train)
+    _, exact_indices = exact.kneighbors(queries)
+    exact_wage = exact.values[exact_indices].mean(axis=1)
+
+    records = []
+    for name, params in configs.items():
+        params = dict(params)
+        columns = params.pop('columns', slice(None))
+
+        start_time = time.perf_counter()
+        imputer = p.BallTreeImputer(n_neighbors = n_neighbors, **params).fit(X_train[:, columns], y_train)
+        build_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        _, indices = imputer.kneighbors(queries[:, columns])
+        query_time = time.perf_counter() - start_time
+
+        # Peak memory in a second pass
+        tracemalloc.start()
+        imputer.kneighbors(queries[:, columns])
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        # Share of the exact neighbours found, row by row
+        recall = np.mean([len(np.intersect1d(found, true)) / n_neighbors
+                          for found, true in zip(indices, exact_indices)])
+
+        records.append({'backend': name,
+                        'build_seconds': round(build_time, 2),
+                        'query_seconds': round(query_time, 2),
+                        'queries_per_second': round(len(queries) / query_time),
+                        'query_peak_mb': round(peak / 1024 ** 2, 1),
+                        f'recall@{n_neighbors}': round(recall, 3),
+                        'wage_mae': round(np.abs(imputer.values[indices].mean(axis=1) - exact_wage).mean(), 4)})
+
+    return pd.DataFrame(records).set_index('backend')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Recall and speed of the neighbour backends of the wage imputer')
+    parser.add_argument('--train', default='./data/train_data_EDA.csv', help='path to train_data_EDA.csv')
+    parser.add_argument('--enc', default='count', choices=['count', 'freq'])
+    parser.add_argument('--neighbors', type=int, default=5, help='number of neighbours')
+    parser.add_argument('--queries', type=int, default=20000, help='number of validation rows queried')
+    parser.add_argument('--tables', type=int, nargs='+', default=[4, 8, 16], help='hash tables of the approximate index')
+    parser.add_argument('--projections', type=int, default=6, help='projections per hash table')
+    parser.add_argument('--components', type=int, nargs='+', default=[8], help='reduced dimensions to try')
+    parser.add_argument('--subset', nargs='+', default=None, help='features to try as a subset of the distances')
+    parser.add_argument('--synthetic', type=int, default=None, help='rows of synthetic features instead of the claims')
+    parser.add_argument('--latent', type=int, default=None, help='latent factors of the synthetic features')
+    args = parser.parse_args()
+
+    if args.synthetic is not None:
+        X_train, y_train, queries, features = synthetic_features(args.synthetic, n_latent = args.latent,
+                                                                 n_queries = args.queries)
+    else:
+        df = pd.read_csv(args.train, index_col = 'Claim Identifier')
+
+        X = df.drop('Claim Injury Type', axis=1)
+        y = df['Claim Injury Type']
+
+        X_train, y_train, queries, features = scaled_features(X, y, args.enc)
+    queries = queries[:args.queries]
+
+    configs = {'ball_tree': {}}
+    for n_tables in args.tables:
+        configs[f'random_projection (tables={n_tables})'] = {
+            'backend': 'random_projection',
+            'index_params': {'n_tables': n_tables, 'n_projections': args.projections}}
+    for n_components in args.components:
+        configs[f'ball_tree (components={n_components})'] = {'n_components': n_components}
+        configs[f'random_projection (components={n_components})'] = {
+            'backend': 'random_projection', 'n_components': n_components,
+            'index_params': {'n_projections': args.projections}}
+    if args.subset is not None:
+        configs['ball_tree (subset)'] = {'columns': [features.index(column) for column in args.subset]}
+
+    print(f'{len(X_train)} training rows, {len(queries)} queries, {len(features)} features')
+    print(benchmark_imputer(X_train, y_train, queries, configs, args.neighbors).to_string())
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+
+# Years pandas holds as datetime64[ns] (to_datetime coerces the others to NaT)
+MIN_YEAR, MAX_YEAR = 1678, 2261
+
+
+def to_float(values):
+
+    """
+    Input:
+        values: column (series of any numeric dtype, nullable integers included) or array
+
+    Output: float64 array, with NaN where the value is missing or not numeric
+    """
+
+    return pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def from_parts(year, month, day):
+
+    """
+    Inputs:
+        year, month, day: integer parts of the dates (columns or arrays)
+
+    Output: datetime64[D] array, with NaT where the date is missing or invalid
+            (e.g. 2021-02-30, month 13, non integer parts), as to_datetime(errors='coerce')
+    """
+
+    year, month, day = to_float(year), to_float(month), to_float(day)
+
+    valid = ((year >= MIN_YEAR) & (year <= MAX_YEAR) & (month >= 1) & (month <= 12) & (day >= 1)
+             & (year == np.floor(year)) & (month == np.floor(month)) & (day == np.floor(day)))
+
+    # First day of each month, from the months since 1970-01
+    months = np.where(valid, (year - 1970) * 12 + month - 1, 0).astype(np.int64).astype('datetime64[M]')
+    first_day = months.astype('datetime64[D]')
+    days_in_month = ((months + 1).astype('datetime64[D]') - first_day).astype(np.int64)
+
+    valid &= day <= days_in_month
+
+    dates = first_day + np.where(valid, day - 1, 0).astype(np.int64).astype('timedelta64[D]')
+    dates[~valid] = np.datetime64('NaT')
+
+    return dates
+
+
+def from_columns(df, prefix):
+
+    """
+    Inputs:
+        df: dataframe with the '{prefix} Year', '{prefix} Month' and '{prefix} Day' columns
+        prefix: date prefix (e.g. 'Accident Date')
+
+    Output: datetime64[D] array of the dates (see from_parts)
+    """
+
+    return from_parts(df[f'{prefix} Year'], df[f'{prefix} Month'], df[f'{prefix} Day'])
+
+
+def day_of_week(dates):
+
+    """
+    Input:
+        dates: datetime64[D] array
+
+    Output: day of the week (Monday=0, Sunday=6, as dt.dayofweek), NaN where the date is NaT
+    """
+
+    # 1970-01-01 was a Thursday
+    days = dates.astype(np.int64)
+    dow = ((days + 3) % 7).astype(np.float64)
+    dow[np.isnat(dates)] = np.nan
+
+    return dow
+
+
+def days_between(end, start):
+
+    """
+    Inputs:
+        end, start: datetime64[D] arrays
+
+    Output: days from start to end (as (end - start).dt.days), NaN where either date is NaT
+    """
+
+    days = (end - start).astype(np.int64).astype(np.float64)
+    days[np.isnat(end) | np.isnat(start)] = np.nan
+
+    return days
+
+
+def date_features(df, prefixes = (), intervals = None):
+
+    """
+    Inputs:
+        df: dataframe with the Year, Month and Day columns of each date
+        prefixes: dates whose day of the week is computed
+        intervals: dictionary with the name and (end, start) prefixes of each interval
+
+    Output: dictionary with the '{prefix} Day of Week' of each prefix and each interval (in days),
+            every date built once
+    """
+
+    intervals = intervals or {}
+
+    needed = list(dict.fromkeys(list(prefixes) + [prefix for pair in intervals.values() for prefix in pair]))
+    dates = {prefix: from_columns(df, prefix) for prefix in needed}
+
+    features = {f'{prefix} Day of Week': day_of_week(dates[prefix]) for prefix in prefixes}
+
+    for name, (end, start) in intervals.items():
+        features[name] = days_between(dates[end], dates[start])
+
+    return features
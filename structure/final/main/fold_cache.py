@@ -0,0 +1,239 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+# Bump when the layout of the cache changes (the preprocessing code is part of every key, see code_fingerprint)
+FOLD_CACHE_VERSION = 3
+
+# Treated frames stored for each fold
+FRAMES = ['X_train', 'y_train', 'X_val', 'test']
+
+# Modules whose code produces the treated folds
+PREPROCESSING_MODULES = ['pipeline.py', 'utils2.py', 'dates.py']
+
+
+def code_fingerprint(modules = PREPROCESSING_MODULES):
+
+    """
+    Input:
+        modules: files of the preprocessing code, next to this module
+
+    Output: hash of their source, so any change to the preprocessing invalidates the cached folds
+    """
+
+    sha = hashlib.sha256()
+
+    for module in modules:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), module)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                sha.update(module.encode('utf-8'))
+                sha.update(f.read())
+
+    return sha.hexdigest()
+
+
+def fingerprint(*dfs):
+
+    """
+    Input:
+        dfs: dataframes or series
+
+    Output: hash of their columns, index and values
+    """
+
+    sha = hashlib.sha256()
+
+    for df in dfs:
+        columns = list(df.columns) if isinstance(df, pd.DataFrame) else [df.name]
+        sha.update(json.dumps(columns, default=str).encode('utf-8'))
+        sha.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+
+    return sha.hexdigest()
+
+
+def fold_key(data_fingerprint, fold, train_index, val_index, method, **settings):
+
+    """
+    Inputs:
+        data_fingerprint: output of fingerprint for X, y and test1
+        fold: number of the fold
+        train_index, val_index: positions of the training and validation rows of the fold
+        method: k-fold method (its parameters are part of the key)
+        settings: preprocessing settings (enc, outliers, under_sample, over_sample)
+
+    Output: key of the treated fold in the cache
+    """
+
+    payload = {
+        'version': FOLD_CACHE_VERSION,
+        'code': code_fingerprint(),
+        'data': data_fingerprint,
+        'fold': fold,
+        'method': repr(method),
+        'train': hashlib.sha256(np.asarray(train_index).tobytes()).hexdigest(),
+        'val': hashlib.sha256(np.asarray(val_index).tobytes()).hexdigest(),
+        'settings': settings
+    }
+
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _index_values(index):
+
+    # Numeric indexes are stored as they are, the others as text (no pickled objects)
+    if pd.api.types.is_numeric_dtype(index.dtype):
+        return index.to_numpy()
+
+    return index.astype(str).to_numpy(dtype=str)
+
+
+# Nullable dtypes, stored as their values and missing value mask
+MASKED_ARRAYS = (pd.arrays.IntegerArray, pd.arrays.FloatingArray, pd.arrays.BooleanArray)
+
+
+def _column_arrays(frame, columns, dtype):
+
+    """
+    Inputs:
+        frame: dataframe
+        columns: columns of the same dtype
+        dtype: their dtype
+
+    Output: values (one row per column, so every column is contiguous) and missing value mask
+            (None for numpy dtypes) of the columns, in their final dtype
+    """
+
+    if isinstance(dtype, np.dtype):
+        return np.stack([frame[column].to_numpy() for column in columns]), None
+
+    arrays = [frame[column].array for column in columns]
+    if all(isinstance(array, MASKED_ARRAYS) for array in arrays):
+        values = np.stack([array.to_numpy(dtype=dtype.numpy_dtype, na_value=0) for array in arrays])
+        return values, np.stack([array.isna() for array in arrays])
+
+    raise TypeError(f'Columns of dtype {dtype} cannot be cached: {columns}')
+
+
+def _column(values, mask, dtype):
+
+    # Views of the memory-mapped files, wrapped without copies
+    if mask is None:
+        return values
+
+    return pd.api.types.pandas_dtype(dtype).construct_array_type()(values, mask, copy=False)
+
+
+class FoldCache:
+
+    """
+    Content addressed cache of treated folds on disk. Each fold is a directory with one
+    .npy file per frame and dtype, with the columns in their final dtype (nullable ones with
+    a mask file), read back memory-mapped: the frames are read-only views of the files.
+
+    Input:
+        cache_dir: directory of the cache
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def get(self, key):
+
+        """
+        Input:
+            key: output of fold_key
+
+        Output: dictionary with the treated frames of the fold, None if it is not cached
+        """
+
+        path = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(path):
+            return None
+
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        def load(file):
+            file = os.path.join(path, file)
+            return np.load(file, mmap_mode='r') if os.path.exists(file) else None
+
+        frames = {}
+        for name in FRAMES:
+            index = pd.Index(np.load(os.path.join(path, f'{name}_index.npy')), name=meta[name]['index_name'])
+
+            # One file per dtype, each column a view of its row
+            columns = {}
+            for group, (dtype, group_columns) in enumerate(meta[name]['groups']):
+                values, mask = load(f'{name}_{group}.npy'), load(f'{name}_{group}_mask.npy')
+                for i, column in enumerate(group_columns):
+                    columns[column] = _column(values[i], None if mask is None else mask[i], dtype)
+
+            if meta[name]['columns'] is None:
+                frames[name] = pd.Series(next(iter(columns.values())), index=index,
+                                         name=meta[name]['name'], copy=False)
+            else:
+                frames[name] = pd.DataFrame({column: columns[column] for column in meta[name]['columns']},
+                                            index=index, copy=False)
+
+        return frames
+
+    def put(self, key, frames):
+
+        """
+        Inputs:
+            key: output of fold_key
+            frames: dictionary with the treated frames of the fold (see FRAMES)
+        """
+
+        path = os.path.join(self.cache_dir, key)
+        if os.path.isdir(path):
+            return
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Written to a temporary directory first, so a fold is either complete or missing
+        tmp_path = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+
+        try:
+            meta = {}
+            for name in FRAMES:
+                frame = frames[name]
+
+                if isinstance(frame, pd.DataFrame):
+                    meta[name] = {'columns': list(frame.columns), 'index_name': frame.index.name}
+                else:
+                    meta[name] = {'columns': None, 'name': frame.name, 'index_name': frame.index.name}
+                    frame = frame.to_frame()
+
+                groups = {}
+                for column, dtype in frame.dtypes.items():
+                    groups.setdefault(dtype, []).append(column)
+
+                # Columns of the same dtype stored together
+                for group, (dtype, columns) in enumerate(groups.items()):
+                    values, mask = _column_arrays(frame, columns, dtype)
+                    np.save(os.path.join(tmp_path, f'{name}_{group}.npy'), values)
+                    if mask is not None:
+                        np.save(os.path.join(tmp_path, f'{name}_{group}_mask.npy'), mask)
+
+                meta[name]['groups'] = [(str(dtype), columns) for dtype, columns in groups.items()]
+                np.save(os.path.join(tmp_path, f'{name}_index.npy'), _index_values(frame.index))
+
+            with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+                json.dump(meta, f, default=str)
+
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another process cached the same fold first
+            if not os.path.isdir(path):
+                raise
+        finally:
+            if os.path.isdir(tmp_path):
+                shutil.rmtree(tmp_path)
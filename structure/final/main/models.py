@@ -1,16 +1,24 @@
 # 
+import os
+import json
 import time
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 # Preprocessing
 import utils2 as p
+from pipeline import ClaimsPreprocessor
+import fold_cache as fc
+
+# Profiling
+from contextlib import nullcontext
+from profiler import StageProfiler, stage, reports_to_frame
 
 # Scalers
 from sklearn.preprocessing import (
     StandardScaler,
-    MinMaxScaler,
-    RobustScaler)
+    MinMaxScaler)
 
 # Models
 from sklearn.linear_model import LogisticRegression, SGDClassifier
@@ -18,7 +26,7 @@ from sklearn.tree import DecisionTreeClassifier
 from sklearn.ensemble import RandomForestClassifier, \
     GradientBoostingClassifier, AdaBoostClassifier, HistGradientBoostingClassifier
 from xgboost import XGBClassifier 
-from lightgbm import LGBMClassifier
+from lightgbm import LGBMClassifier, early_stopping
 from sklearn.neural_network import MLPClassifier
 from sklearn.naive_bayes import GaussianNB
 from sklearn.neighbors import KNeighborsClassifier
@@ -33,7 +41,8 @@ from imblearn.over_sampling import RandomOverSampler
 
 
 
-def run_model(model_name, X, y, random_state, params = None):
+def run_model(model_name, X, y, random_state, params = None,
+              eval_set = None, early_stopping_rounds = None):
 
     """
     Inputs:
@@ -43,6 +52,11 @@ def run_model(model_name, X, y, random_state, params = None):
         params: parameters for said model
         - should be inputed as follows: {'model_name': {'parameter1': value1,
                                                         'parameter2': value2 }}
+        eval_set: validation data (X_val, y_val) used for early stopping
+        early_stopping_rounds: rounds without improvement of the multi-class log-loss before the
+                               boosted models stop (None to train every iteration)
+        - XGB and LGBM stop on eval_set, HGBoost and GBoost on an internal 10% validation split
+          of X (their fit does not take a validation set)
 
 
     Outputs: fitted model
@@ -51,6 +65,21 @@ def run_model(model_name, X, y, random_state, params = None):
     if params is None:
         params = {}
 
+    # Early stopping of the boosted models
+    fit_params = {}
+    if early_stopping_rounds is not None:
+        if model_name == 'XGB' and eval_set is not None:
+            params = dict(params, early_stopping_rounds=early_stopping_rounds, eval_metric='mlogloss')
+            fit_params = {'eval_set': [eval_set], 'verbose': False}
+        elif model_name == 'LGBM' and eval_set is not None:
+            fit_params = {'eval_set': [eval_set], 'eval_metric': 'multi_logloss',
+                          'callbacks': [early_stopping(early_stopping_rounds, verbose=False)]}
+        elif model_name == 'HGBoost':
+            params = dict(params, early_stopping=True, scoring='loss',
+                          n_iter_no_change=early_stopping_rounds)
+        elif model_name == 'GBoost':
+            params = dict(params, n_iter_no_change=early_stopping_rounds)
+
     if model_name == 'LR':
         model = LogisticRegression(**params, random_state=random_state).fit(X, y)
     elif model_name == 'SGD':
@@ -64,7 +93,7 @@ def run_model(model_name, X, y, random_state, params = None):
     elif model_name == 'GBoost':
         model = GradientBoostingClassifier(**params, random_state=random_state).fit(X, y)
     elif model_name == 'XGB':
-        model = XGBClassifier(**params, random_state=random_state).fit(X, y)
+        model = XGBClassifier(**params, random_state=random_state).fit(X, y, **fit_params)
     elif model_name == 'MLP':
         model = MLPClassifier(**params, random_state=random_state).fit(X, y)
     elif model_name == 'GNB':  
@@ -72,7 +101,7 @@ def run_model(model_name, X, y, random_state, params = None):
     elif model_name == 'KNN':  
         model = KNeighborsClassifier(**params).fit(X, y)
     elif model_name == 'LGBM':  
-        model = LGBMClassifier(**params, random_state=random_state).fit(X, y)
+        model = LGBMClassifier(**params, random_state=random_state).fit(X, y, **fit_params)
     elif model_name == 'SVM':  
         model = SVC(**params,).fit(X, y)
     elif model_name == 'HGBoost':  
@@ -82,10 +111,36 @@ def run_model(model_name, X, y, random_state, params = None):
     return model
 
 
+def best_iteration(model):
+
+    """
+    Input:
+        model: fitted model
+
+    Output: number of boosting iterations kept after early stopping (None for other models)
+    """
+
+    # XGB and LGBM predict with their best iteration, HGBoost and GBoost keep only the iterations used
+    if isinstance(model, LGBMClassifier):
+        return model.best_iteration_ or None
+    if isinstance(model, XGBClassifier):
+        # best_iteration is 0-based in XGB
+        try:
+            return model.best_iteration + 1
+        except AttributeError:
+            return None
+    if isinstance(model, HistGradientBoostingClassifier):
+        return model.n_iter_
+    if isinstance(model, GradientBoostingClassifier):
+        return model.n_estimators_
+
+    return None
+
+
 def modeling(model_names, params,
              X_train, y_train, 
              X_val, y_val, 
-             random_state):
+             random_state, early_stopping_rounds = None):
     
     """
     Inputs:
@@ -93,6 +148,7 @@ def modeling(model_names, params,
         params: parameters for said models
         X_train, y_train, X_val, y_val: training and validation data
         random_state: random_state parameter
+        early_stopping_rounds: early stopping of the boosted models on the validation data (see run_model)
 
     Output: dictionary with performance emtrics
     """
@@ -103,7 +159,8 @@ def modeling(model_names, params,
         print(f"Training model: {model_name}")
         
         # Training
-        model = run_model(model_name, X_train, y_train, random_state, params.get(model_name, {}))
+        model = run_model(model_name, X_train, y_train, random_state, params.get(model_name, {}),
+                          eval_set = (X_val, y_val), early_stopping_rounds = early_stopping_rounds)
         
         # Predictions
         y_train_pred = model.predict(X_train)
@@ -125,7 +182,8 @@ def modeling(model_names, params,
             'train_recall': train_recall,
             'val_recall': val_recall,
             'train_macro_f1': train_f1,
-            'val_macro_f1': val_f1
+            'val_macro_f1': val_f1,
+            'best_iteration': best_iteration(model)
         }
         
         print(f"{model_name} - Train: Precision: {train_precision:.4f}, Recall: {train_recall:.4f}, Macro F1: {train_f1:.4f}")
@@ -136,270 +194,175 @@ def modeling(model_names, params,
 
 # KFOLD
 
-def k_fold(method, X, y, test1, model_name, random_state,
-           params, enc, col = None, outliers = False,
-           file_name = None,
-           under_sample = False, over_sample = False):
-    
-    """
-    Inputs:
-        method: k-fold method
-        X, y: all data but target and target
-        test1: test data
-        model_name: model to use for training
-        random_state: random_state parameter
-        params: parameters for said model
-        enc: type of encoding to be used ('count' for Count Encoding, 'freq' for Frequency Encoding)
-        col: columns to be used (if None uses all columns)
-        outliers: True for outliers to be treated, False otherwise
-        file_name: name for csv file with predictions
-        under_sample: if undersampling is to be applied
-        over_sample: if oversampling is to be applied
-        
-    Outputs: average time and metrics, the test dataset and the predictions made
-    
-    """
-     
-    if over_sample:
-        oversampler = RandomOverSampler(random_state=42, sampling_strategy='auto') 
-    if under_sample:
-        undersampler = RandomUnderSampler(random_state=42, 
-                                          sampling_strategy='auto')
-                                                                
-
-    # Save metrics
-    f1macro_train = []
-    f1macro_val = []
-    precision_train = []
-    precision_val = []
-    recall_train = []
-    recall_val = []
-    timer = []
-    
-    # Mapping
-    label_mapping = {
-        0: "1. CANCELLED",
-        1: "2. NON-COMP",
-        2: "3. MED ONLY",
-        3: "4. TEMPORARY",
-        4: "5. PPD SCH LOSS",
-        5: "6. PPD NSL",
-        6: "7. PTD",
-        7: "8. DEATH"}
-    
-    test_preds = np.zeros((len(test1), len(label_mapping)))
-
-
-    # For each fold
-    for train_index, val_index in method.split(X, y):
-        X_train, X_val = X.iloc[train_index], X.iloc[val_index]
-        y_train, y_val = y.iloc[train_index], y.iloc[val_index]
-        test = test1.copy()
-
-        start_time = time.time()
-        
-
-        # ENCODING
-        X_train['Alternative Dispute Resolution Enc'] = X_train['Alternative Dispute Resolution'].replace({'N': 0, 'Y': 1, 'U': 1})
-        X_val['Alternative Dispute Resolution Enc'] = X_val['Alternative Dispute Resolution'].replace({'N': 0, 'Y': 1, 'U': 1})
-        test['Alternative Dispute Resolution Enc'] = test['Alternative Dispute Resolution'].replace({'N': 0, 'Y': 1, 'U': 1})
-
-        X_train['Attorney/Representative Enc'] = X_train['Attorney/Representative'].replace({'N': 0, 'Y': 1})
-        X_val['Attorney/Representative Enc'] = X_val['Attorney/Representative'].replace({'N': 0, 'Y': 1})
-        test['Attorney/Representative Enc'] = test['Attorney/Representative'].replace({'N': 0, 'Y': 1})
-
-        train_carriers = set(X_train['Carrier Name'].unique())
-        test_carriers = set(test['Carrier Name'].unique())
-        common_categories = train_carriers.intersection(test_carriers)
-        common_category_map = {category: idx + 1 for idx, 
-                           category in enumerate(common_categories)}
-
-        X_train['Carrier Name Enc'] = X_train['Carrier Name'].map(common_category_map).fillna(0).astype(int)
-        X_val['Carrier Name Enc'] = X_val['Carrier Name'].map(common_category_map).fillna(0).astype(int)
-        test['Carrier Name Enc'] = test['Carrier Name'].map(common_category_map).fillna(0).astype(int)
-
-        X_train, X_val, test = p.encode(X_train, X_val, test, 'Carrier Name Enc', enc)
-
-        X_train, X_val, test = p.encode(X_train, X_val, test, 'Carrier Type', enc)
-        X_train, X_val, test = p.encode(X_train, X_val, test, 'Carrier Type', 'OHE')
-
-        X_train, X_val, test = p.encode(X_train, X_val, test, 'County of Injury', enc)
-        
-        X_train['COVID-19 Indicator Enc'] = X_train['COVID-19 Indicator'].replace({'N': 0, 'Y': 1})
-        X_val['COVID-19 Indicator Enc'] = X_val['COVID-19 Indicator'].replace({'N': 0, 'Y': 1})
-        test['COVID-19 Indicator Enc'] = test['COVID-19 Indicator'].replace({'N': 0, 'Y': 1})
-
-        X_train, X_val, test = p.encode(X_train, X_val, test, 'District Name', enc)
-
-        X_train, X_val, test = p.encode(X_train, X_val, test, 'Gender', 'OHE')
-
-        X_train, X_val, test = p.encode(X_train, X_val, test, 'Medical Fee Region', enc)
+# Data shared with the worker processes of k_fold (set once per process)
+_fold_data = {}
 
-        X_train, X_val, test = p.encode(X_train, X_val, test, 'Industry Sector', enc)
 
-        drop = ['Alternative Dispute Resolution', 'Attorney/Representative', 'Carrier Type', 'County of Injury',
-                'COVID-19 Indicator', 'District Name', 'Gender', 'Carrier Name',
-                'Medical Fee Region', 'Industry Sector']
+def _effective_jobs(n_jobs):
 
-        X_train.drop(columns = drop, axis = 1, inplace = True)
-        X_val.drop(columns = drop, axis = 1, inplace = True)
-        test.drop(columns = drop, axis = 1, inplace = True)
+    # As sklearn: None is 1, -1 is every core, -2 every core but one, ...
+    if n_jobs is None:
+        return 1
+    if n_jobs == 0:
+        raise ValueError("n_jobs == 0 has no meaning, use a positive number or -1 for all cores")
+    if n_jobs < 0:
+        return max(os.cpu_count() + 1 + n_jobs, 1)
 
-        # MISSING VALUES
-        X_train['C-3 Date Binary'] = X_train['C-3 Date'].notna().astype(int)
-        X_val['C-3 Date Binary'] = X_val['C-3 Date'].notna().astype(int)
-        test['C-3 Date Binary'] = test['C-3 Date'].notna().astype(int)
+    return n_jobs
 
-        X_train['First Hearing Date Binary'] = X_train['First Hearing Date'].notna().astype(int)
-        X_val['First Hearing Date Binary'] = X_val['First Hearing Date'].notna().astype(int)
-        test['First Hearing Date Binary'] = test['First Hearing Date'].notna().astype(int)
 
-        drop = ['C-3 Date', 'First Hearing Date']
-        X_train.drop(columns = drop, axis = 1, inplace = True)
-        X_val.drop(columns = drop, axis = 1, inplace = True)
-        test.drop(columns = drop, axis = 1, inplace = True)
+def _init_fold_worker(X, y, test1):
+    _fold_data.update(X = X, y = y, test1 = test1)
 
-        X_train['IME-4 Count'] = X_train['IME-4 Count'].fillna(0)
-        X_val['IME-4 Count'] = X_val['IME-4 Count'].fillna(0)
-        test['IME-4 Count'] = test['IME-4 Count'].fillna(0)
 
-        X_train['Industry Code'] = X_train['Industry Code'].fillna(0)
-        X_val['Industry Code'] = X_val['Industry Code'].fillna(0)
-        test['Industry Code'] = test['Industry Code'].fillna(0)
+def _run_fold_worker(indices, fold_args):
+    train_index, val_index = indices
+    return run_fold(train_index, val_index, _fold_data['X'], _fold_data['y'],
+                    _fold_data['test1'], **fold_args)
 
-        p.fill_dates(X_train, [X_val, test], 'Accident Date')
-        p.fill_dates(X_train, [X_val, test], 'C-2 Date')
 
-        p.fill_dow([X_train, X_val, test], 'Accident Date')
-        p.fill_dow([X_train, X_val, test], 'C-2 Date')
-
-        X_train = p.fill_missing_times(X_train, ['Accident to Assembly Time', 
-                                 'Assembly to C-2 Time',
-                                 'Accident to C-2 Time'])
-
-        X_val = p.fill_missing_times(X_val, ['Accident to Assembly Time', 
-                                 'Assembly to C-2 Time',
-                                 'Accident to C-2 Time'])
-
-        test = p.fill_missing_times(test, ['Accident to Assembly Time', 
-                                 'Assembly to C-2 Time',
-                                 'Accident to C-2 Time'])
-
-        p.fill_birth_year([X_train, X_val, test])
+def run_fold(train_index, val_index, X, y, test1, model_name, random_state,
+             params, enc, col = None, outliers = False,
+             under_sample = False, over_sample = False, return_test = False,
+             cache_dir = None, cache_key = None, early_stopping_rounds = None,
+             compact = False, profile = False, impute_jobs = None, imputer_params = None,
+             hash_buckets = None):
 
+    """
+    Inputs:
+        train_index, val_index: positions of the training and validation rows of the fold
+        X, y, test1, model_name, random_state, params, enc, col, outliers, under_sample, over_sample,
+        early_stopping_rounds, compact, profile, impute_jobs, imputer_params, hash_buckets: see k_fold
+        return_test: if the treated test data is to be returned
+        cache_dir, cache_key: fold cache and key of the fold (see fold_cache.fold_key)
+
+    Output: dictionary with the metrics, test probabilities and time of each model,
+            the fold time, the profile of the fold if profile (and the treated test data if return_test)
+    """
 
-        # Variables
-        num = ['Age at Injury', 'Average Weekly Wage', 'Birth Year',
-           'IME-4 Count', 'Number of Dependents', 'Accident Date Year',
-           'Accident Date Month', 'Accident Date Day', 
-           'Assembly Date Year', 'Assembly Date Month', 
-           'Assembly Date Day', 'C-2 Date Year', 'C-2 Date Month',
-           'C-2 Date Day', 'Accident to Assembly Time',
-           'Assembly to C-2 Time', 'Accident to C-2 Time']
+    model_names = [model_name] if isinstance(model_name, str) else list(model_name)
 
-        categ = [var for var in X_train.columns if var not in num]
+    X_train, X_val = X.iloc[train_index], X.iloc[val_index]
+    y_train, y_val = y.iloc[train_index], y.iloc[val_index]
 
-        categ_count_encoding = ['Carrier Name Enc', 'Carrier Type Enc',
-                                'County of Injury Enc', 'District Name Enc',
-                                'Medical Fee Region Enc', 
-                                'Industry Sector Enc']
+    start_time = time.time()
 
+    # Stages timed by the profiler (no-ops when profile is False)
+    profiler = StageProfiler(cprofile = (profile == 'cprofile')) if profile else nullcontext()
 
-        categ_label_bin = [var for var in X_train.columns if var
-                           in categ and var not in categ_count_encoding]
+    with profiler:
+        cache = fc.FoldCache(cache_dir) if cache_dir is not None else None
+        with stage('cache read'):
+            cached = cache.get(cache_key) if cache is not None else None
 
-        num_count_enc = num + categ_count_encoding
+        if cached is not None:
+            X_train_RS, y_train, X_val_RS, test_RS = (cached[name] for name in fc.FRAMES)
+        else:
+            # Preprocessing (learned on the training rows of the fold, carriers restricted to the test ones)
+            with stage('preprocess'):
+                preprocessor = ClaimsPreprocessor(enc = enc, outliers = outliers, compact = compact,
+                                                  n_jobs = impute_jobs, imputer_params = imputer_params,
+                                                  hash_buckets = hash_buckets)
+                X_train_RS, y_train = preprocessor.fit_transform(X_train, y_train, carrier_reference = test1)
+                X_val_RS, test_RS = preprocessor.transform(X_val, test1)
+
+            # Oversampling and Undersmpling
+            with stage('sampling'):
+                if over_sample:
+                    oversampler = RandomOverSampler(random_state=42, sampling_strategy='auto')
+                    X_train_RS, y_train = oversampler.fit_resample(X_train_RS, y_train)
+                    print(y_train.value_counts())
+
+                elif under_sample:
+                    undersampler = RandomUnderSampler(random_state=42, 
+                                                      sampling_strategy='auto')
+                    X_train_RS, y_train = undersampler.fit_resample(X_train_RS, y_train)
+                    print(y_train.value_counts())
+
+            with stage('cache write'):
+                if cache is not None:
+                    cache.put(cache_key, {'X_train': X_train_RS, 'y_train': y_train,
+                                          'X_val': X_val_RS, 'test': test_RS})
+
+        prep_time = time.time() - start_time
+
+        if col is not None:
+            X_train_RS, X_val_RS, test_model = X_train_RS[col], X_val_RS[col], test_RS[col]
+        else:
+            test_model = test_RS
 
+        # Training (every model on the same treated fold)
+        fold_results = {'models': {}}
 
-        # Scale
-        robust = RobustScaler()
+        for name in model_names:
+            model_start = time.time()
 
-        X_train_num_count_enc_RS = robust.fit_transform(X_train[num_count_enc])
-        X_train_num_count_enc_RS = pd.DataFrame(X_train_num_count_enc_RS, columns=num_count_enc, index=X_train.index)
-        X_val_num_count_enc_RS = robust.transform(X_val[num_count_enc])
-        X_val_num_count_enc_RS = pd.DataFrame(X_val_num_count_enc_RS, columns=num_count_enc, index=X_val.index)
-        test_num_count_enc_RS = robust.transform(test[num_count_enc])
-        test_num_count_enc_RS = pd.DataFrame(test_num_count_enc_RS, columns=num_count_enc, index=test.index)
+            with stage(f'{name} fit'):
+                model = run_model(name, X_train_RS, y_train, random_state = random_state,
+                                  params = params.get(name, {}), eval_set = (X_val_RS, y_val),
+                                  early_stopping_rounds = early_stopping_rounds)
+            # Predictions
+            with stage(f'{name} predict'):
+                pred_train = model.predict(X_train_RS)
+                pred_val = model.predict(X_val_RS)
+            with stage(f'{name} predict_proba'):
+                test_proba = model.predict_proba(test_model)
+
+            # Metrics
+            with stage(f'{name} metrics'):
+                fold_results['models'][name] = {
+                    'f1_train': f1_score(y_train, pred_train, average='macro'),
+                    'f1_val': f1_score(y_val, pred_val, average='macro'),
+                    'precision_train': precision_score(y_train, pred_train, average='macro'),
+                    'precision_val': precision_score(y_val, pred_val, average='macro'),
+                    'recall_train': recall_score(y_train, pred_train, average='macro'),
+                    'recall_val': recall_score(y_val, pred_val, average='macro'),
+                    'test_proba': test_proba,
+                    'best_iteration': best_iteration(model),
+                    # Preprocessing plus training of the model
+                    'time': round((prep_time + time.time() - model_start) / 60, 2)
+                }
+
+    # Compute Time
+    end_time = time.time()
+    fold_results['time'] = round((end_time - start_time) / 60, 2)
+
+    if profile:
+        fold_results['profile'] = profiler.to_dict()
+
+    if return_test:
+        fold_results['test_data'] = test_RS
+
+    return fold_results
+
+
+def summarize_folds(model_results, n_splits, test_RS, label_mapping):
 
-        X_train_RS = pd.concat([X_train_num_count_enc_RS, 
-                                X_train[categ_label_bin]], axis=1)
-        X_val_RS = pd.concat([X_val_num_count_enc_RS, 
-                              X_val[categ_label_bin]], axis=1)
-        test_RS = pd.concat([test_num_count_enc_RS, 
-                             test[categ_label_bin]], axis=1)
+    """
+    Inputs:
+        model_results: results of one model in each fold (see run_fold)
+        n_splits: number of folds
+        test_RS: treated test data
+        label_mapping: mapping of the predicted classes
 
-        p.ball_tree_impute([X_train_RS, X_val_RS, test_RS], 
-                           'Average Weekly Wage')
-        
-        if outliers:
-            X_train_RS = X_train_RS[X_train_RS['Age at Injury'] < 2.0217391304347827]
-            
-            X_train_RS['Average Weekly Wage Sqrt'] = np.sqrt(X_train_RS['Average Weekly Wage'])
-
-            X_val_RS['Average Weekly Wage Sqrt'] = np.sqrt(X_val_RS['Average Weekly Wage'])
-
-            test_RS['Average Weekly Wage Sqrt'] = np.sqrt(test_RS['Average Weekly Wage'])
-            
-            upper_limit = X_train_RS['Average Weekly Wage'].quantile(0.99)
-            lower_limit = X_train_RS['Average Weekly Wage'].quantile(0.01)
-
-            X_train_RS['Average Weekly Wage'] = X_train_RS['Average Weekly Wage'].clip(lower = lower_limit
-                                                                  , upper=upper_limit)
-            
-            X_train_RS = X_train_RS[X_train_RS['Birth Year'] > -1.9782608695652173]
-            
-            X_train_RS['IME-4 Count Log'] = np.log1p(X_train_RS['IME-4 Count'])
-            X_train_RS['IME-4 Count Double Log'] = np.log1p(X_train_RS['IME-4 Count Log'])
-
-            X_val_RS['IME-4 Count Log'] = np.log1p(X_val_RS['IME-4 Count'])
-            X_val_RS['IME-4 Count Double Log'] = np.log1p(X_val_RS['IME-4 Count Log'])
-
-            test_RS['IME-4 Count Log'] = np.log1p(test_RS['IME-4 Count'])
-            test_RS['IME-4 Count Double Log'] = np.log1p(test_RS['IME-4 Count Log'])
-            
-            X_train_RS = X_train_RS[X_train_RS['Accident Date Year'] > -2.0]
-            
-            X_train_RS = X_train_RS[X_train_RS['C-2 Date Year'] > -2.0]
-            
-            y_train = y_train[X_train_RS.index]
-            
-            
-        # Oversampling and Undersmpling
-        if over_sample:
-            X_train_RS, y_train = oversampler.fit_resample(X_train_RS, y_train)
-            print(y_train.value_counts())
-
-        elif under_sample:
-            X_train_RS, y_train = undersampler.fit_resample(X_train_RS, y_train)
-            print(y_train.value_counts())
-            
-        # Training
-        if col == None:
-            model = run_model(model_name, X_train_RS, y_train, random_state = random_state, params = params.get(model_name, {}))
-            # Predictions
-            pred_train = model.predict(X_train_RS)
-            pred_val = model.predict(X_val_RS)
-            test_preds += model.predict_proba(test_RS)
-        else:
-            model = run_model(model_name, X_train_RS[col], y_train, random_state = random_state, params = params.get(model_name, {}))
-            # Predictions
-            pred_train = model.predict(X_train_RS[col])
-            pred_val = model.predict(X_val_RS[col])
-            test_preds += model.predict_proba(test_RS[col])
+    Output: average time and metrics, the time and best iteration of each fold, the test
+            probabilities and the predictions made (soft voting over the folds)
+    """
 
-        # Metrics
-        f1macro_train.append(f1_score(y_train, pred_train, average='macro'))
-        f1macro_val.append(f1_score(y_val, pred_val, average='macro'))
-        precision_train.append(precision_score(y_train, pred_train, average='macro')) 
-        precision_val.append(precision_score(y_val, pred_val, average='macro'))  
-        recall_train.append(recall_score(y_train, pred_train, average='macro'))
-        recall_val.append(recall_score(y_val, pred_val, average='macro'))
-        
-        # Compute Time
-        end_time = time.time()
-        elapsed_time = round((end_time - start_time) / 60, 2)
-        timer.append(elapsed_time) 
-        print(f'This Fold took {elapsed_time} minutes')
+    # Save metrics
+    f1macro_train = [r['f1_train'] for r in model_results]
+    f1macro_val = [r['f1_val'] for r in model_results]
+    precision_train = [r['precision_train'] for r in model_results]
+    precision_val = [r['precision_val'] for r in model_results]
+    recall_train = [r['recall_train'] for r in model_results]
+    recall_val = [r['recall_val'] for r in model_results]
+    timer = [r['time'] for r in model_results]
+    best_iterations = [r['best_iteration'] for r in model_results]
+
+    # Soft voting accumulator, summed in fold order
+    test_preds = np.zeros((len(test_RS), len(label_mapping)))
+    for r in model_results:
+        test_preds += r['test_proba']
 
     # Metrics Average and Stdev
     avg_time = round(np.mean(timer), 3)
@@ -418,19 +381,12 @@ def k_fold(method, X, y, test1, model_name, random_state,
     std_recall_val = round(np.std(recall_val), 3)
 
     # Final Predictions using Soft Voting
-    final_test_preds = np.argmax(test_preds / method.get_n_splits(), axis=1)
-    test_RS['Claim Injury Type'] = final_test_preds 
-
-    test_RS['Claim Injury Type'] = test_RS['Claim Injury Type'].replace(label_mapping)
-    
-    predictions = test_RS['Claim Injury Type']
-    
-    if file_name != None:
-    
-        predictions.to_csv(f'./pred/corrected_k_fold/{file_name}.csv')
+    test_proba = test_preds / n_splits
+    final_test_preds = np.argmax(test_proba, axis=1)
 
+    predictions = pd.Series(final_test_preds, index=test_RS.index,
+                            name='Claim Injury Type').replace(label_mapping)
 
-    # Return data and treated Test_RS
     return {
         'avg_time': str(avg_time) + '+/-' + str(std_time),
         'avg_f1_train': str(avg_f1_train) + '+/-' + str(std_f1_train),
@@ -439,6 +395,141 @@ def k_fold(method, X, y, test1, model_name, random_state,
         'avg_precision_val': str(avg_precision_val) + '+/-' + str(std_precision_val),
         'avg_recall_train': str(avg_recall_train) + '+/-' + str(std_recall_train),
         'avg_recall_val': str(avg_recall_val) + '+/-' + str(std_recall_val),
-        'test_data': test_RS,
+        'fold_times': timer,
+        'best_iterations': best_iterations,
+        'test_proba': test_proba,
         'predictions': predictions
     }
+
+
+def k_fold(method, X, y, test1, model_name, random_state,
+           params, enc, col = None, outliers = False,
+           file_name = None,
+           under_sample = False, over_sample = False,
+           n_jobs = 1, cache_dir = None, early_stopping_rounds = None,
+           compact = False, profile = False, impute_jobs = None, imputer_params = None,
+           hash_buckets = None):
+    
+    """
+    Inputs:
+        method: k-fold method
+        X, y: all data but target and target
+        test1: test data
+        model_name: model to use for training, or list of models trained on the same folds
+        random_state: random_state parameter
+        params: parameters for said model(s)
+        enc: type of encoding to be used ('count' for Count Encoding, 'freq' for Frequency Encoding)
+        col: columns to be used (if None uses all columns)
+        outliers: True for outliers to be treated, False otherwise
+        file_name: name for csv file with predictions
+        under_sample: if undersampling is to be applied
+        over_sample: if oversampling is to be applied
+        n_jobs: number of folds run at the same time in a process pool (None for 1, -1 for all cores,
+                -2 for all but one, ...);
+                models that are multithreaded themselves (e.g. XGB) may need fewer threads in params
+        cache_dir: directory where the treated folds are cached (None to disable), so later runs
+                   with the same data, folds and preprocessing settings skip the preprocessing
+        early_stopping_rounds: early stopping of the boosted models on the multi-class log-loss of
+                               the validation fold (None to train every iteration, see run_model)
+        compact: True to keep the data in compact dtypes (category text, int8/int16 codes, uint8 flags,
+                 float32 numerics), see pipeline.compare_memory for the memory saved at each stage
+        profile: True to time and sample the peak memory of every stage of each fold
+                 (preprocessing steps, fit, predict, predict_proba), 'cprofile' to also capture a cProfile
+        impute_jobs: parallel jobs of the Average Weekly Wage neighbour queries (None for 1, -1 for all cores)
+        imputer_params: neighbour backend of the Average Weekly Wage imputer, e.g.
+                        {'backend': 'random_projection', 'n_components': 8} (see pipeline.ClaimsPreprocessor
+                        and benchmark_imputer.py for its recall against the exact ball tree)
+        hash_buckets: buckets of the high-cardinality columns hashed instead of encoded, e.g.
+                      {'Carrier Name': 4096} (None keeps the training carriers common to the test data,
+                      see pipeline.ClaimsPreprocessor)
+        
+    Outputs: average time and metrics, the time of each fold, the test dataset and the predictions made
+             (for a list of models, {'models': these results for each model, 'test_data': test dataset}),
+             and if profile the stage profile of each fold as a dataframe ('profile') and as JSON ('profile_json')
+    
+    """
+
+    # Mapping
+    label_mapping = {
+        0: "1. CANCELLED",
+        1: "2. NON-COMP",
+        2: "3. MED ONLY",
+        3: "4. TEMPORARY",
+        4: "5. PPD SCH LOSS",
+        5: "6. PPD NSL",
+        6: "7. PTD",
+        7: "8. DEATH"}
+
+    folds = list(method.split(X, y))
+
+    # Compact dtypes for the raw data, shared by every fold
+    if compact:
+        X, test1 = p.compact_dtypes(X), p.compact_dtypes(test1)
+
+    fold_args = {'model_name': model_name, 'random_state': random_state,
+                 'params': params, 'enc': enc, 'col': col, 'outliers': outliers,
+                 'under_sample': under_sample, 'over_sample': over_sample,
+                 'early_stopping_rounds': early_stopping_rounds, 'compact': compact,
+                 'profile': profile, 'impute_jobs': impute_jobs, 'imputer_params': imputer_params,
+                 'hash_buckets': hash_buckets}
+
+    # Cache keys of the treated folds
+    cache_keys = [None] * len(folds)
+    if cache_dir is not None:
+        data_fingerprint = fc.fingerprint(X, y, test1)
+        cache_keys = [fc.fold_key(data_fingerprint, fold, train_index, val_index, method,
+                                  enc = enc, outliers = outliers,
+                                  under_sample = under_sample, over_sample = over_sample,
+                                  compact = compact, imputer_params = imputer_params,
+                                  hash_buckets = hash_buckets)
+                      for fold, (train_index, val_index) in enumerate(folds)]
+
+    # Only the last fold sends back its treated test data
+    fold_args_list = [dict(fold_args, return_test = (fold == len(folds) - 1),
+                           cache_dir = cache_dir, cache_key = cache_keys[fold])
+                      for fold in range(len(folds))]
+
+    # For each fold
+    n_jobs = _effective_jobs(n_jobs)
+    if n_jobs == 1:
+        results = [run_fold(train_index, val_index, X, y, test1, **args)
+                   for (train_index, val_index), args in zip(folds, fold_args_list)]
+    else:
+        # Results come back in fold order, whatever order the folds finish in
+        with ProcessPoolExecutor(max_workers = min(n_jobs, len(folds)),
+                                 initializer = _init_fold_worker,
+                                 initargs = (X, y, test1)) as executor:
+            results = list(executor.map(_run_fold_worker, folds, fold_args_list))
+
+    for fold, r in enumerate(results):
+        print(f'Fold {fold + 1} took {r["time"]} minutes')
+
+    test_RS = results[-1]['test_data']
+
+    model_names = [model_name] if isinstance(model_name, str) else list(model_name)
+
+    summaries = {}
+    for name in model_names:
+        summaries[name] = summarize_folds([r['models'][name] for r in results],
+                                          method.get_n_splits(), test_RS, label_mapping)
+
+        if file_name != None:
+            suffix = '' if isinstance(model_name, str) else f'_{name}'
+            summaries[name]['predictions'].to_csv(f'./pred/corrected_k_fold/{file_name}{suffix}.csv')
+
+    # One model: metrics, predictions and treated Test_RS (with the predictions)
+    if isinstance(model_name, str):
+        summary = summaries[model_name]
+        summary['test_data'] = test_RS.assign(**{'Claim Injury Type': summary['predictions']})
+    # Many models: metrics and predictions of each model (under 'models', apart from the
+    # reserved keys), and the treated Test_RS
+    else:
+        summary = {'models': summaries, 'test_data': test_RS}
+
+    # Stage profile of each fold
+    if profile:
+        reports = [r['profile'] for r in results]
+        summary['profile'] = reports_to_frame(reports)
+        summary['profile_json'] = json.dumps(reports, indent=2)
+
+    return summary
@@ -0,0 +1,501 @@
+import numpy as np
+import pandas as pd
+
+# Preprocessing
+import utils2 as p
+from profiler import stage
+
+# Scaler
+from sklearn.preprocessing import RobustScaler
+
+
+def _map(values, mapping):
+
+    # Categorical columns are mapped once per category instead of once per row
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        lookup = values.cat.categories.map(mapping).to_numpy(dtype='float64', na_value=np.nan)
+        lookup = np.append(lookup, np.nan)
+        return pd.Series(lookup[values.cat.codes.to_numpy()], index=values.index)
+
+    return values.map(mapping)
+
+
+def _values(column):
+
+    # Column as a float array (nullable integers included)
+    if isinstance(column, pd.Series):
+        return column.to_numpy(dtype='float64', na_value=np.nan)
+
+    return column
+
+
+def _take(column, rows):
+
+    # Selected rows of a column, keeping its dtype
+    if isinstance(column, pd.Series):
+        return column.array[rows]
+
+    return column[rows]
+
+
+class ClaimsPreprocessor:
+
+    """
+    Preprocessing of the claims (encoding, missing values, scaling, Average Weekly Wage
+    imputation and outlier treatment), learned once on the training data with fit and
+    applied to any number of dataframes with transform.
+
+    Inputs:
+        enc: type of encoding to be used ('count' for Count Encoding, 'freq' for Frequency Encoding)
+        outliers: True for outliers to be treated, False otherwise
+        n_neighbors: number of neighbours used to impute Average Weekly Wage
+        n_jobs: parallel jobs of the neighbour queries (see utils2.BallTreeImputer)
+        imputer_params: neighbour backend of the imputer (backend, n_components, index_params,
+                        see utils2.BallTreeImputer) and 'columns', the subset of features used
+                        for the distances (None for every feature)
+        hash_buckets: dictionary with the number of buckets of each high-cardinality column hashed
+                      instead of encoded with a training vocabulary (e.g. {'Carrier Name': 4096,
+                      'Zip Code': 1024}, see utils2.hash_encode), None to hash nothing
+        compact: True to keep the treated data in compact dtypes (uint8 flags, int8/int16 codes,
+                 float32 numerics, see utils2.compact_dtypes)
+        track_memory: True to record the memory of each frame after each stage (see memory_report)
+    """
+
+    # Binary encodings (training data uses 'Y'/'N', the web app form uses 'Yes'/'No')
+    binary_mapping = {
+        'Alternative Dispute Resolution': {'N': 0, 'Y': 1, 'U': 1, 'No': 0, 'Yes': 1},
+        'Attorney/Representative': {'N': 0, 'Y': 1, 'No': 0, 'Yes': 1},
+        'COVID-19 Indicator': {'N': 0, 'Y': 1, 'No': 0, 'Yes': 1}
+    }
+
+    # Encoded columns, in the order they are created
+    encoding_steps = [
+        ('binary', 'Alternative Dispute Resolution'),
+        ('binary', 'Attorney/Representative'),
+        ('carrier', 'Carrier Name'),
+        ('enc', 'Carrier Name Enc'),
+        ('enc', 'Carrier Type'),
+        ('OHE', 'Carrier Type'),
+        ('enc', 'County of Injury'),
+        ('binary', 'COVID-19 Indicator'),
+        ('enc', 'District Name'),
+        ('OHE', 'Gender'),
+        ('enc', 'Medical Fee Region'),
+        ('enc', 'Industry Sector')
+    ]
+
+    # Dropped after encoding
+    encoded_drop = ['Alternative Dispute Resolution', 'Attorney/Representative', 'Carrier Type', 'County of Injury',
+                    'COVID-19 Indicator', 'District Name', 'Gender', 'Carrier Name',
+                    'Medical Fee Region', 'Industry Sector']
+
+    # Variables
+    num = ['Age at Injury', 'Average Weekly Wage', 'Birth Year',
+           'IME-4 Count', 'Number of Dependents', 'Accident Date Year',
+           'Accident Date Month', 'Accident Date Day',
+           'Assembly Date Year', 'Assembly Date Month',
+           'Assembly Date Day', 'C-2 Date Year', 'C-2 Date Month',
+           'C-2 Date Day', 'Accident to Assembly Time',
+           'Assembly to C-2 Time', 'Accident to C-2 Time']
+
+    categ_count_encoding = ['Carrier Name Enc', 'Carrier Type Enc',
+                            'County of Injury Enc', 'District Name Enc',
+                            'Medical Fee Region Enc',
+                            'Industry Sector Enc']
+
+    time_columns = ['Accident to Assembly Time',
+                    'Assembly to C-2 Time',
+                    'Accident to C-2 Time']
+
+    # Columns read and filled by the date, time and Birth Year fills
+    date_columns = ['Accident Date Year', 'Accident Date Month', 'Accident Date Day',
+                    'Accident Date Day of Week',
+                    'Assembly Date Year', 'Assembly Date Month', 'Assembly Date Day',
+                    'C-2 Date Year', 'C-2 Date Month', 'C-2 Date Day',
+                    'C-2 Date Day of Week',
+                    'Age at Injury', 'Birth Year'] + time_columns
+
+    target = 'Average Weekly Wage'
+
+    # Canonical text of the hashed columns (default: stripped and upper case, see utils2.hash_encode)
+    hash_canonical = {'Zip Code': p.canonical_zip}
+
+    # Training rows kept when outliers are treated (bounds on the scaled features)
+    outlier_bounds = {
+        'Age at Injury': (None, 2.0217391304347827),
+        'Birth Year': (-1.9782608695652173, None),
+        'Accident Date Year': (-2.0, None),
+        'C-2 Date Year': (-2.0, None)
+    }
+
+    def __init__(self, enc = 'count', outliers = False, n_neighbors = 5,
+                 compact = False, track_memory = False, n_jobs = None, imputer_params = None,
+                 hash_buckets = None):
+
+        self.enc = enc
+        self.outliers = outliers
+        self.n_neighbors = n_neighbors
+        self.n_jobs = n_jobs
+        self.imputer_params = imputer_params
+        self.hash_buckets = hash_buckets
+        self.compact = compact
+        self.track_memory = track_memory
+
+        self.memory = []
+
+    ## FIT
+
+    def fit(self, X_train, carrier_reference = None):
+
+        """
+        Inputs:
+            X_train: training data
+            carrier_reference: data whose carriers restrict the Carrier Name categories
+                               (e.g. the test data, None keeps every training carrier),
+                               unused when Carrier Name is hashed
+
+        Output: fitted preprocessor
+        """
+
+        self._fit(X_train, carrier_reference)
+
+        return self
+
+    def fit_transform(self, X_train, y_train = None, carrier_reference = None):
+
+        """
+        Inputs:
+            X_train, y_train: training data and target
+            carrier_reference: see fit
+
+        Output: treated training data (and target, aligned with the rows kept)
+        """
+
+        columns, index = self._fit(X_train, carrier_reference)
+
+        # Training only outlier treatment
+        with stage('assemble'):
+            if self.outliers:
+                X_train_RS = self._treat_train_outliers(columns, index)
+            else:
+                X_train_RS = pd.DataFrame(columns, index=index)
+
+        if y_train is None:
+            return X_train_RS
+
+        return X_train_RS, y_train[X_train_RS.index]
+
+    def _fit(self, X_train, carrier_reference):
+
+        # Encodings
+        with stage('fit encodings'):
+            self._fit_encodings(X_train, carrier_reference)
+
+        # Scaling
+        self._track(X_train, 'train', 'input')
+        with stage('encode'):
+            X_train = self._encode(X_train)
+        self._track(X_train, 'train', 'encode')
+
+        self.num_count_enc = self.num + self.categ_count_encoding
+        self.categ_label_bin = [var for var in X_train.columns
+                                if var not in self.num_count_enc]
+
+        with stage('fit scaler'):
+            self.scaler = RobustScaler().fit(X_train[self.num_count_enc])
+
+        with stage('scale'):
+            columns = self._scale(X_train)
+        self._track(columns, 'train', 'scale')
+
+        # Average Weekly Wage imputer (fitted on the training rows where it is known)
+        with stage('fit imputer'):
+            params = dict(self.imputer_params or {})
+            features = params.pop('columns', None)
+
+            self.impute_features = [column for column in columns
+                                    if column != self.target and (features is None or column in features)]
+
+            known = ~np.isnan(columns[self.target])
+            self.imputer = p.BallTreeImputer(n_neighbors=self.n_neighbors, n_jobs=self.n_jobs, **params)
+            self.imputer.fit(self._feature_matrix(columns, known), columns[self.target][known])
+
+        with stage('impute'):
+            self._impute(columns)
+        self._track(columns, 'train', 'impute')
+
+        # Winsorization limits, from the training rows kept
+        with stage('outliers'):
+            if self.outliers:
+                upper = self.outlier_bounds['Age at Injury'][1]
+                kept = pd.Series(columns[self.target][columns['Age at Injury'] < upper])
+                self.wage_limits = (kept.quantile(0.01), kept.quantile(0.99))
+
+            self._add_outlier_features(columns)
+
+        return columns, X_train.index
+
+    def _fit_encodings(self, X_train, carrier_reference):
+
+        # Carrier Name labels (none to learn when it is hashed)
+        values = X_train['Carrier Name']
+        self.carrier_map = None
+
+        if 'Carrier Name' not in (self.hash_buckets or {}):
+            categories = set(values.dropna().unique())
+            if carrier_reference is not None:
+                categories &= set(carrier_reference['Carrier Name'].dropna().unique())
+
+            self.carrier_map = {category: idx + 1 for idx, category in enumerate(sorted(categories))}
+
+        work = {'Carrier Name Enc': self._carrier_labels(values)}
+
+        # Count/frequency and one hot vocabularies, learned in one pass
+        steps = [(self.enc if kind == 'enc' else kind, column) for kind, column in self.encoding_steps
+                 if kind in ['enc', 'OHE']]
+        self.encoder = p.CategoricalEncoder(steps).fit({column: work[column] if column in work else X_train[column]
+                                                        for _, column in steps})
+
+        # Accident Date & C-2 Date medians
+        self.date_medians = {}
+        for prefix in ['Accident Date', 'C-2 Date']:
+            for part in ['Year', 'Month', 'Day']:
+                col = f'{prefix} {part}'
+                self.date_medians[col] = round(X_train[col].median())
+
+    ## TRANSFORM
+
+    def transform(self, *dfs, progress = None):
+
+        """
+        Inputs:
+            dfs: one or more dataframes (validation, test or new claims), left unchanged
+            progress: optional callback, called with the name of each stage
+
+        Output: treated dataframe(s), ready for the model
+        """
+
+        if progress is None:
+            progress = lambda stage: None
+
+        treated = []
+        for frame, df in enumerate(dfs):
+            self._track(df, frame, 'input')
+
+            progress('encode')
+            with stage('encode'):
+                encoded = self._encode(df)
+            self._track(encoded, frame, 'encode')
+
+            progress('scale')
+            with stage('scale'):
+                columns = self._scale(encoded)
+            self._track(columns, frame, 'scale')
+
+            progress('impute')
+            with stage('impute'):
+                self._impute(columns)
+            self._track(columns, frame, 'impute')
+
+            with stage('outliers'):
+                self._add_outlier_features(columns)
+
+            # Each output frame is assembled once, from its columns
+            with stage('assemble'):
+                treated.append(pd.DataFrame(columns, index=encoded.index))
+
+        return treated[0] if len(treated) == 1 else tuple(treated)
+
+    def _encode(self, df):
+
+        # New and changed columns are collected here, the input frame is never modified
+        new = {}
+
+        # ENCODING
+        for kind, column in self.encoding_steps:
+            values = new[column] if column in new else df[column]
+
+            if kind == 'binary':
+                if isinstance(values.dtype, pd.CategoricalDtype):
+                    new[f'{column} Enc'] = _map(values, self.binary_mapping[column])
+                else:
+                    new[f'{column} Enc'] = values.replace(self.binary_mapping[column])
+
+            elif kind == 'carrier':
+                new['Carrier Name Enc'] = self._carrier_labels(values)
+
+            elif kind == 'enc':
+                encoded = self.encoder.count(values, column, normalize = self.enc == 'freq')
+                new[f'{column} Enc'] = pd.Series(encoded, index=df.index)
+
+            elif kind == 'OHE':
+                # Dense, as the models read a dataframe (see utils2.CategoricalEncoder for CSR output)
+                encoded = self.encoder.one_hot(values, column, sparse = False)
+                for i, category in enumerate(self.encoder.categories(column)):
+                    new[f'{column}_{category}'] = pd.Series(encoded[:, i], index=df.index)
+
+        # Hashed high-cardinality columns (when present, e.g. Zip Code)
+        for column, n_buckets in (self.hash_buckets or {}).items():
+            if column != 'Carrier Name' and column in df:
+                new[f'{column} Enc'] = pd.Series(p.hash_encode(df[column], n_buckets, self.hash_canonical.get(column)),
+                                                 index=df.index)
+
+        # MISSING VALUES
+        new['C-3 Date Binary'] = df['C-3 Date'].notna().astype(int)
+        new['First Hearing Date Binary'] = df['First Hearing Date'].notna().astype(int)
+
+        filled = {'IME-4 Count': df['IME-4 Count'].fillna(0),
+                  'Industry Code': df['Industry Code'].fillna(0)}
+
+        # Dates, times and Birth Year are filled in place on a copy of their columns only
+        dates = df[self.date_columns].copy()
+
+        with stage('fill dates'):
+            for col, med in self.date_medians.items():
+                dates[col] = dates[col].fillna(med).astype('Int64')
+
+            p.fill_dow([dates], 'Accident Date')
+            p.fill_dow([dates], 'C-2 Date')
+
+        with stage('fill times'):
+            dates = p.fill_missing_times(dates, self.time_columns)
+
+        with stage('fill birth year'):
+            p.fill_birth_year([dates])
+
+        filled.update(dates.items())
+
+        # Input columns (filled ones replaced, encoded ones dropped), then the new columns
+        drop = set(self.encoded_drop + ['C-3 Date', 'First Hearing Date'] + list(self.hash_buckets or {}))
+
+        columns = {column: filled.get(column, values) for column, values in df.items()
+                   if column not in drop}
+        columns.update(new)
+
+        if self.compact:
+            columns = {column: p.compact_column(values) for column, values in columns.items()}
+
+        return pd.DataFrame(columns, index=df.index)
+
+    def _carrier_labels(self, values):
+
+        # Hashed buckets, or the training carriers (0 for the others)
+        if self.carrier_map is None:
+            return pd.Series(p.hash_encode(values, self.hash_buckets['Carrier Name']), index=values.index)
+
+        return _map(values, self.carrier_map).fillna(0).astype(int)
+
+    def _scale(self, df):
+
+        # Scale
+        scaled = self.scaler.transform(df[self.num_count_enc])
+        if self.compact:
+            scaled = scaled.astype(np.float32)
+
+        columns = {column: scaled[:, i] for i, column in enumerate(self.num_count_enc)}
+        columns.update((column, df[column]) for column in self.categ_label_bin)
+
+        return columns
+
+    def _feature_matrix(self, columns, rows):
+
+        # Imputer features of the selected rows, in the training column order
+        return np.column_stack([_values(columns[column])[rows] for column in self.impute_features])
+
+    def _impute(self, columns):
+
+        # Average Weekly Wage: mean of the nearest training neighbours
+        wage = columns[self.target]
+        missing = np.isnan(wage)
+
+        if missing.any():
+            wage[missing] = self.imputer.predict(self._feature_matrix(columns, missing))
+
+    def _add_outlier_features(self, columns):
+
+        if self.outliers:
+            columns['Average Weekly Wage Sqrt'] = np.sqrt(columns['Average Weekly Wage'])
+
+            columns['IME-4 Count Log'] = np.log1p(columns['IME-4 Count'])
+            columns['IME-4 Count Double Log'] = np.log1p(columns['IME-4 Count Log'])
+
+    ## MEMORY
+
+    def _track(self, data, frame, stage):
+
+        if self.track_memory:
+            if isinstance(data, dict):
+                values = list(data.values())
+                rows = len(values[0])
+                memory = sum(v.nbytes if isinstance(v, np.ndarray) else v.memory_usage(index=False, deep=True)
+                             for v in values) / 1024 ** 2
+            else:
+                rows = len(data)
+                memory = p.memory_mb(data)
+
+            self.memory.append({'frame': frame, 'stage': stage, 'rows': rows, 'memory_mb': memory})
+
+    def memory_report(self):
+
+        """
+        Output: memory (MB) of each frame ('train' in fit, position in transform) after each stage
+        """
+
+        return pd.DataFrame(self.memory, columns=['frame', 'stage', 'rows', 'memory_mb'])
+
+    ## OUTLIERS
+
+    def _treat_train_outliers(self, columns, index):
+
+        """
+        Inputs:
+            columns: treated training columns
+            index: index of the training data
+
+        Output: training data without the outlier rows and with Average Weekly Wage winsorized
+        """
+
+        keep = np.ones(len(index), dtype=bool)
+        for column, (lower, upper) in self.outlier_bounds.items():
+            values = _values(columns[column])
+            if lower is not None:
+                keep &= values > lower
+            if upper is not None:
+                keep &= values < upper
+
+        lower_limit, upper_limit = self.wage_limits
+        columns[self.target] = np.clip(columns[self.target], lower_limit, upper_limit)
+
+        return pd.DataFrame({column: _take(values, keep) for column, values in columns.items()},
+                            index=index[keep])
+
+
+def compare_memory(X_train, *dfs, **kwargs):
+
+    """
+    Inputs:
+        X_train: training data
+        dfs: other dataframes to transform (e.g. validation and test)
+        kwargs: other parameters of ClaimsPreprocessor (enc, outliers)
+
+    Output: memory (MB) of each frame after each stage, with the default and the compact dtypes
+    """
+
+    reports = {}
+
+    for compact in [False, True]:
+        preprocessor = ClaimsPreprocessor(compact = compact, track_memory = True, **kwargs)
+
+        if compact:
+            X_train, dfs = p.compact_dtypes(X_train), [p.compact_dtypes(df) for df in dfs]
+
+        preprocessor.fit(X_train)
+        preprocessor.transform(*dfs)
+
+        report = preprocessor.memory_report().set_index(['frame', 'stage'])
+        reports['compact' if compact else 'default'] = report['memory_mb']
+
+    report = pd.concat(reports, axis=1)
+    report['saved %'] = (1 - report['compact'] / report['default']) * 100
+
+    return report.round(2)
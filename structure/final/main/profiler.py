@@ -0,0 +1,196 @@
+import contextvars
+import cProfile
+import io
+import json
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+# Profiler of the running context (None when nothing is profiled)
+_active = contextvars.ContextVar('profiler', default=None)
+
+
+class StageProfiler:
+
+    """
+    Named timers and peak memory of each stage, with an optional cProfile capture.
+    Stages are opened with stage() anywhere in the code run inside the profiler
+    (nested stages are recorded with their path, e.g. 'preprocess/encode').
+
+        with StageProfiler() as profiler:
+            ...
+        profiler.report()
+
+    Inputs:
+        memory: True to sample the peak memory of each stage (tracemalloc, slows the code down)
+        cprofile: True to also capture a cProfile of everything run inside the profiler
+    """
+
+    def __init__(self, memory = True, cprofile = False):
+
+        self.memory = memory
+        self.cprofile = cprofile
+
+        self.records = []
+        self._stack = []
+        self._profile = None
+        self._token = None
+        self._started_tracemalloc = False
+
+    def __enter__(self):
+
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+        if self.cprofile:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+        self._token = _active.set(self)
+
+        return self
+
+    def __exit__(self, *exc):
+
+        _active.reset(self._token)
+
+        if self._profile is not None:
+            self._profile.disable()
+
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+        return False
+
+    @contextmanager
+    def stage(self, name):
+
+        """
+        Input:
+            name: name of the stage
+        """
+
+        path = '/'.join([entry['path'] for entry in self._stack[-1:]] + [name])
+        entry = {'path': path, 'peak': 0}
+
+        if self.memory:
+            # The peak reached so far belongs to the enclosing stage
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            entry['start_memory'] = tracemalloc.get_traced_memory()[0]
+
+        self._stack.append(entry)
+        start_time = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed_time = time.perf_counter() - start_time
+            self._stack.pop()
+
+            record = {'stage': path, 'seconds': elapsed_time}
+
+            if self.memory:
+                peak = max(entry['peak'], tracemalloc.get_traced_memory()[1])
+                record['peak_mb'] = (peak - entry['start_memory']) / 1024 ** 2
+
+                if self._stack:
+                    self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+
+            self.records.append(record)
+
+    def report(self):
+
+        """
+        Output: dataframe with the calls, total seconds and peak memory (MB, above the memory
+                at the start of the stage) of each stage, in the order the stages were first run
+        """
+
+        records = pd.DataFrame(self.records, columns=['stage', 'seconds', 'peak_mb'])
+
+        report = records.groupby('stage', sort=False).agg(calls=('seconds', 'size'),
+                                                          seconds=('seconds', 'sum'),
+                                                          peak_mb=('peak_mb', 'max'))
+
+        return report.reset_index()
+
+    def cprofile_stats(self, top = 25, sort = 'cumulative'):
+
+        """
+        Inputs:
+            top: number of functions shown
+            sort: pstats sort key
+
+        Output: cProfile statistics as text (None if cprofile is off)
+        """
+
+        if self._profile is None:
+            return None
+
+        stream = io.StringIO()
+        pstats.Stats(self._profile, stream=stream).sort_stats(sort).print_stats(top)
+
+        return stream.getvalue()
+
+    def to_dict(self):
+
+        """
+        Output: JSON friendly report (stages and cProfile statistics)
+        """
+
+        return {'stages': self.report().to_dict(orient='records'),
+                'cprofile': self.cprofile_stats()}
+
+    def to_json(self, path = None):
+
+        """
+        Input:
+            path: file where the report is written (None to only return it)
+
+        Output: report as JSON
+        """
+
+        report = json.dumps(self.to_dict(), indent=2)
+
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(report)
+
+        return report
+
+
+@contextmanager
+def stage(name):
+
+    """
+    Input:
+        name: name of the stage, timed by the profiler of the running context (if any)
+    """
+
+    profiler = _active.get()
+
+    if profiler is None:
+        yield
+    else:
+        with profiler.stage(name):
+            yield
+
+
+def reports_to_frame(reports):
+
+    """
+    Input:
+        reports: profiler reports (to_dict) of each fold
+
+    Output: dataframe with one row per fold and stage
+    """
+
+    return pd.concat([pd.DataFrame(report['stages']).assign(fold = fold + 1)
+                      for fold, report in enumerate(reports)], ignore_index=True)
@@ -1,9 +1,11 @@
 import numpy as np
 import pandas as pd
 
+import dates as d
+
 # Encoder and NN
 from sklearn.neighbors import NearestNeighbors
-from sklearn.preprocessing import OneHotEncoder
+from scipy.sparse import csr_matrix, hstack
 
 # Plots
 import matplotlib.pyplot as plt
@@ -13,6 +15,237 @@ import seaborn as sns
 
 ## ENCODE
 
+class CategoricalEncoder:
+
+    """
+    Count, frequency and one hot encodings learned in one pass over the training data.
+    Each column is factorized once into a sorted vocabulary with the count of each category,
+    and every transform maps the values to integer codes in that vocabulary: count and
+    frequency encodings are lookups of the codes, one hot encodings are built from them as
+    sparse (CSR) matrices, so their cost grows with the rows and not with the categories.
+
+    Input:
+        steps: list of (kind, column), kind 'count' for Count Encoding, 'freq' for Frequency
+               Encoding or 'OHE' for One Hot Encoding (same categories as OneHotEncoder:
+               sorted, missing last, with the first one dropped)
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    def fit(self, df):
+
+        """
+        Input:
+            df: training data (dataframe or dictionary of columns)
+
+        Output: fitted encoder
+        """
+
+        self.vocabularies = {}
+        self.counts = {}
+        self.missing = {}
+
+        for column in dict.fromkeys(column for _, column in self.steps):
+            values = df[column]
+
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                categories = values.cat.categories
+                codes = values.cat.codes.to_numpy()
+            else:
+                codes, categories = pd.factorize(values, sort=True)
+                categories = pd.Index(categories)
+
+            # Categories seen in the training data, sorted
+            counts = np.bincount(codes[codes >= 0], minlength=len(categories))
+            observed = counts > 0
+            order = categories[observed].argsort()
+
+            self.vocabularies[column] = categories[observed][order]
+            self.counts[column] = counts[observed][order]
+            self.missing[column] = bool((codes < 0).any())
+
+        return self
+
+    def codes(self, values, column):
+
+        """
+        Inputs:
+            values: column to be encoded
+            column: name of the column in the training data
+
+        Output: position of each value in the vocabulary (-1 for missing and unseen values)
+        """
+
+        vocabulary = self.vocabularies[column]
+
+        # Categorical columns are looked up once per category instead of once per row
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            lookup = np.append(vocabulary.get_indexer(values.cat.categories), -1)
+            return lookup[values.cat.codes.to_numpy()]
+
+        return vocabulary.get_indexer(values)
+
+    def count(self, values, column, normalize = False):
+
+        """
+        Inputs:
+            values: column to be encoded
+            column: name of the column in the training data
+            normalize: True for the frequency instead of the count
+
+        Output: training count (or frequency) of each value, 0 for missing and unseen values
+        """
+
+        counts = self.counts[column]
+        lookup = counts / counts.sum() if normalize else counts
+
+        # Code -1 reads the 0 appended at the end
+        return np.append(lookup, 0)[self.codes(values, column)]
+
+    def categories(self, column):
+
+        """
+        Input:
+            column: name of a one hot encoded column
+
+        Output: categories of its one hot columns (the first one dropped, NaN for missing values)
+        """
+
+        categories = list(self.vocabularies[column])
+        if self.missing[column]:
+            categories.append(np.nan)
+
+        return categories[1:]
+
+    def one_hot(self, values, column, sparse = True):
+
+        """
+        Inputs:
+            values: column to be encoded
+            column: name of the column in the training data
+            sparse: True for a CSR matrix, False for a dense int array
+
+        Output: one hot encoding of the values (see categories for its columns)
+        """
+
+        codes = self.codes(values, column)
+
+        # Missing values have their own column if the training data had them
+        if self.missing[column]:
+            codes = np.where(np.asarray(pd.isna(values)), len(self.vocabularies[column]), codes)
+
+        # The first category is dropped, so its code and unseen values (-1) set no column
+        columns = codes - 1
+        rows = columns >= 0
+        n_columns = len(self.categories(column))
+
+        if not sparse:
+            encoded = np.zeros((len(codes), n_columns), dtype=int)
+            encoded[np.flatnonzero(rows), columns[rows]] = 1
+            return encoded
+
+        indptr = np.concatenate([[0], np.cumsum(rows)])
+        return csr_matrix((np.ones(rows.sum(), dtype=np.int8), columns[rows], indptr),
+                          shape=(len(codes), n_columns))
+
+    def feature_names(self):
+
+        """
+        Output: names of the count/frequency columns and of the one hot columns
+        """
+
+        dense = [f'{column} Enc' for kind, column in self.steps if kind != 'OHE']
+        ohe = [f'{column}_{category}' for kind, column in self.steps if kind == 'OHE'
+               for category in self.categories(column)]
+
+        return dense, ohe
+
+    def transform(self, df, sparse = True):
+
+        """
+        Inputs:
+            df: data to be encoded (dataframe or dictionary of columns)
+            sparse: True for the one hot columns as a single CSR matrix,
+                    False for dense int columns (for models that need them)
+
+        Output: dictionary with the count/frequency columns, and the one hot columns
+                (a CSR matrix in the order of feature_names, or a dictionary of dense columns)
+        """
+
+        dense = {f'{column} Enc': self.count(df[column], column, normalize = kind == 'freq')
+                 for kind, column in self.steps if kind != 'OHE'}
+
+        if sparse:
+            matrices = [self.one_hot(df[column], column) for kind, column in self.steps if kind == 'OHE']
+            ohe = hstack(matrices, format='csr') if matrices else None
+        else:
+            ohe = {}
+            for kind, column in self.steps:
+                if kind == 'OHE':
+                    encoded = self.one_hot(df[column], column, sparse = False)
+                    ohe.update((f'{column}_{category}', encoded[:, i])
+                               for i, category in enumerate(self.categories(column)))
+
+        return dense, ohe
+
+
+def canonical_zip(values):
+
+    """
+    Input:
+        values: Zip Code column, as text ('01234', ' 1234.0') or as numbers (1234.0)
+
+    Output: zip codes as canonical text (no '.0', zero padded to 5 digits), so the same zip code
+            has the same key whichever way it was read; other text is stripped and upper case
+    """
+
+    if pd.api.types.is_numeric_dtype(values):
+        text = values.round().astype('Int64').astype(str)
+    else:
+        text = values.astype(str).str.strip().str.upper().str.replace(r'\.0+$', '', regex=True)
+
+    digits = text.str.fullmatch(r'\d{1,5}')
+
+    return text.where(~digits, text.str.zfill(5))
+
+
+def hash_encode(values, n_buckets, canonical = None):
+
+    """
+    Inputs:
+        values: high-cardinality column to be encoded (e.g. Carrier Name, Zip Code)
+        n_buckets: number of buckets
+        canonical: function giving the canonical text of the values before they are hashed
+                   (e.g. canonical_zip), None to strip and upper case them
+
+    Output: bucket of each value (1 to n_buckets, missing values in their own bucket 0), from a
+            stable hash of the value alone, so it needs no training vocabulary and does not depend
+            on the other rows
+    """
+
+    # Categorical columns are hashed once per category instead of once per row
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        lookup = np.append(hash_encode(pd.Series(values.cat.categories), n_buckets, canonical), 0)
+        return lookup[values.cat.codes.to_numpy()]
+
+    missing = np.asarray(values.isna())
+
+    # Same key for the same value, whether read as a number (10001.0) or as text (' 10001')
+    if canonical is not None:
+        keys = canonical(values)
+    elif pd.api.types.is_numeric_dtype(values):
+        keys = values.round().astype('Int64').astype(str)
+    else:
+        keys = values.astype(str).str.strip().str.upper()
+
+    hashes = pd.util.hash_array(keys.to_numpy(dtype=object), categorize=True)
+    buckets = (hashes % np.uint64(n_buckets)).astype(np.int64) + 1
+    buckets[missing] = 0
+
+    return buckets
+
+
 def encode(train, val, test, column, type_):
 
     """
@@ -23,51 +256,29 @@ def encode(train, val, test, column, type_):
 
     Output: Datasets with the new Encoded Feature(s)
     """
-    
-    # Count Encoding
-    if type_ == 'count':
-        new_column = column + ' Enc'  
-
-        # Count encoding based on training data
-        freq = train[column].value_counts()
-        train[new_column] = train[column].map(freq).astype(int)
-        val[new_column] = val[column].map(freq).astype(int)
-        test[new_column] = test[column].map(freq).astype(int)
-
-    # Frequency Encoding
-    elif type_ == 'freq':
-        new_column = column + ' Enc'  
-
-        # Count encoding based on training data
-        freq = train[column].value_counts(normalize = True)
-        train[new_column] = train[column].map(freq)
-        val[new_column] = val[column].map(freq)
-        test[new_column] = test[column].map(freq)
-        
+
+    # Vocabulary learned on the training data (see CategoricalEncoder)
+    encoder = CategoricalEncoder([(type_, column)]).fit(train)
+
+    # Count / Frequency Encoding
+    if type_ in ['count', 'freq']:
+        new_column = column + ' Enc'
+
+        train[new_column] = encoder.count(train[column], column, normalize = type_ == 'freq')
+        val[new_column] = encoder.count(val[column], column, normalize = type_ == 'freq')
+        test[new_column] = encoder.count(test[column], column, normalize = type_ == 'freq')
+
     # One Hot Encoding
     elif type_ == 'OHE':
 
-        encoder = OneHotEncoder(sparse_output=False, handle_unknown='ignore')
-        
-        # Fit on the training data and transform all datasets
-        train_encoded = encoder.fit_transform(train[[column]])
-        val_encoded = encoder.transform(val[[column]])
-        test_encoded = encoder.transform(test[[column]])
-        
-        # Get new column names
-        ohe_columns = [f"{column}_{category}" for category in encoder.categories_[0]]
-
-        # Convert encoded arrays to DataFrames, drop the first column and convert to integers in one step
-        train_ohe = pd.DataFrame(train_encoded, columns=ohe_columns, index=train.index).iloc[:, 1:].astype(int)
-        val_ohe = pd.DataFrame(val_encoded, columns=ohe_columns, index=val.index).iloc[:, 1:].astype(int)
-        test_ohe = pd.DataFrame(test_encoded, columns=ohe_columns, index=test.index).iloc[:, 1:].astype(int)
+        # Get new column names (first category dropped)
+        ohe_columns = [f"{column}_{category}" for category in encoder.categories(column)]
 
-        
         # Append the encoded columns back to the original DataFrames
-        train = pd.concat([train, train_ohe], axis=1)
-        val = pd.concat([val, val_ohe], axis=1)
-        test = pd.concat([test, test_ohe], axis=1)
-        
+        train, val, test = (pd.concat([df, pd.DataFrame(encoder.one_hot(df[column], column, sparse = False),
+                                                        columns=ohe_columns, index=df.index)], axis=1)
+                            for df in [train, val, test])
+
     return train, val, test
 
 
@@ -132,18 +343,9 @@ def fill_dow(dataframes, feature_prefix):
         # If missing
         if missing_dayofweek.any():
 
-            # Create a temporary 'Accident Date'
-            df.loc[missing_dayofweek, 'TEMP Accident Date'] = pd.to_datetime(
-                df.loc[missing_dayofweek, [year_col, month_col, day_col]]
-                .astype(str)                   
-                .agg('-'.join, axis=1),        
-                errors='coerce')
-            
-            # Fill the missing 'Day of Week' 
-            df.loc[missing_dayofweek, dayofweek_col] = df.loc[missing_dayofweek, 'TEMP Accident Date'].dt.dayofweek
-            
-            # Drop Temo
-            df.drop(columns=['TEMP Accident Date'], inplace=True, errors='ignore')
+            # Day of the week of the dates rebuilt from their parts (NaN for invalid dates)
+            df.loc[missing_dayofweek, dayofweek_col] = d.day_of_week(
+                d.from_columns(df.loc[missing_dayofweek, [year_col, month_col, day_col]], feature_prefix))
         
         # Convert to int
         df[dayofweek_col] = df[dayofweek_col].astype('Int64')
@@ -172,6 +374,305 @@ def fill_birth_year(dfs):
         df.loc[mask, birth_year_col] = df[year_col] - df[age_col]
 
 
+class RandomProjectionIndex:
+
+    """
+    Approximate nearest neighbours with random projection hashing (p-stable LSH).
+    Each table hashes the rows into buckets of a few random projections; the rows sharing
+    a bucket with the query in any table are the candidates, ranked by their exact distance.
+
+    Inputs:
+        n_tables: number of hash tables (more tables, better recall and slower queries)
+        n_projections: projections per table (more projections, smaller buckets)
+        bucket_width: width of the buckets, in standard deviations of the projections
+        max_bucket_size: rows read from each bucket (bounds the candidates of crowded buckets)
+        max_probe_radius: how far the neighbouring buckets are probed for queries with fewer
+                          candidates than neighbours (the few still short are searched exactly)
+        chunk_size: queries whose candidates are gathered and ranked at a time
+        random_state: random_state parameter
+    """
+
+    def __init__(self, n_tables = 8, n_projections = 6, bucket_width = 1.0, max_bucket_size = 256,
+                 max_probe_radius = 3, chunk_size = 128, random_state = 0):
+
+        self.n_tables = n_tables
+        self.n_projections = n_projections
+        self.bucket_width = bucket_width
+        self.max_bucket_size = max_bucket_size
+        self.max_probe_radius = max_probe_radius
+        self.chunk_size = chunk_size
+        self.random_state = random_state
+
+    def fit(self, X):
+
+        """
+        Input:
+            X: rows of the index
+
+        Output: fitted index
+        """
+
+        rng = np.random.default_rng(self.random_state)
+
+        self.X = np.asarray(X, dtype=np.float64)
+        self.exact = None
+        n_features = self.X.shape[1]
+
+        self.projections = rng.normal(size=(self.n_tables, n_features, self.n_projections))
+        self.widths = np.empty(self.n_tables)
+        self.offsets = np.empty((self.n_tables, self.n_projections))
+        self.multipliers = rng.integers(1, 2 ** 31, size=self.n_projections)
+
+        self.orders = []
+        self.sorted_keys = []
+
+        for table in range(self.n_tables):
+            projected = self.X @ self.projections[table]
+
+            # Robust spread of the projections (IQR of a normal), so heavy tails do not widen every bucket
+            q1, q3 = np.percentile(projected, [25, 75])
+            self.widths[table] = self.bucket_width * max((q3 - q1) / 1.349, 1e-12)
+            self.offsets[table] = rng.uniform(0, self.widths[table], size=self.n_projections)
+
+            # Rows sorted by bucket, so each bucket is a contiguous range
+            keys = self._keys(projected, table)
+            order = np.argsort(keys, kind='stable')
+
+            self.orders.append(order)
+            self.sorted_keys.append(keys[order])
+
+        return self
+
+    def _keys(self, projected, table):
+
+        # One integer per bucket (wrapping overflow is fine for a hash)
+        buckets = np.floor((projected + self.offsets[table]) / self.widths[table]).astype(np.int64)
+
+        with np.errstate(over='ignore'):
+            return buckets @ self.multipliers
+
+    def _hits(self, table, keys, limit):
+
+        # Rows in the bucket of each key (at most limit), as (query, row) pairs
+        left = np.searchsorted(self.sorted_keys[table], keys, side='left')
+        right = np.searchsorted(self.sorted_keys[table], keys, side='right')
+        lengths = np.minimum(right - left, limit)
+
+        # Position in the sorted table of every hit, without a loop over the queries
+        group_starts = np.cumsum(lengths) - lengths
+        positions = np.repeat(left - group_starts, lengths) + np.arange(lengths.sum())
+
+        return np.repeat(np.arange(len(keys)), lengths), self.orders[table][positions]
+
+    def _unique_pairs(self, pairs):
+
+        # Distinct (query, row) pairs, sorted by query
+        queries = np.concatenate([query for query, _ in pairs]).astype(np.int64)
+        rows = np.concatenate([row for _, row in pairs]).astype(np.int64)
+        combined = np.unique(queries * len(self.X) + rows)
+
+        return combined // len(self.X), combined % len(self.X)
+
+    def _kneighbors_chunk(self, X, n_neighbors):
+
+        keys = [self._keys(X @ self.projections[table], table) for table in range(self.n_tables)]
+        queries, rows = self._unique_pairs([self._hits(table, keys[table], self.max_bucket_size)
+                                            for table in range(self.n_tables)])
+        counts = np.bincount(queries, minlength=len(X))
+
+        # Multi-probe: queries short of candidates also read the buckets next to theirs
+        # (one projection moved by +-radius, i.e. the key moved by +-radius times its multiplier),
+        # n_neighbors rows at most from each of them
+        radius = 1
+        while (counts < n_neighbors).any() and radius <= self.max_probe_radius:
+            short = np.flatnonzero(counts < n_neighbors)
+            pairs = [(queries, rows)]
+
+            with np.errstate(over='ignore'):
+                for table in range(self.n_tables):
+                    for multiplier in self.multipliers:
+                        for step in (-radius, radius):
+                            probe_queries, probe_rows = self._hits(table, keys[table][short] + step * multiplier,
+                                                                   n_neighbors)
+                            pairs.append((short[probe_queries], probe_rows))
+
+            queries, rows = self._unique_pairs(pairs)
+            counts = np.bincount(queries, minlength=len(X))
+            radius += 1
+
+        distances = np.empty((len(X), n_neighbors))
+        indices = np.empty((len(X), n_neighbors), dtype=np.int64)
+
+        # Queries still short of candidates: exact search, for them only
+        short = counts < n_neighbors
+        if short.any():
+            distances[short], indices[short] = self._exact_index().kneighbors(X[short], n_neighbors)
+
+            kept = ~short[queries]
+            queries, rows = queries[kept], rows[kept]
+            counts[short] = 0
+
+        if len(queries):
+            # Exact distance of every candidate, then the n_neighbors closest of each query
+            # (pairs sorted by query and distance, memory bounded by the candidates)
+            difference = self.X[rows] - X[queries]
+            squared = np.einsum('ij,ij->i', difference, difference)
+
+            order = np.lexsort((squared, queries))
+            starts = (np.cumsum(counts) - counts)[~short]
+            positions = order[starts[:, None] + np.arange(n_neighbors)]
+
+            distances[~short] = np.sqrt(squared[positions])
+            indices[~short] = rows[positions]
+
+        return distances, indices
+
+    def _exact_index(self):
+
+        # Ball tree over the index rows, built the first time a query runs out of candidates
+        if self.exact is None:
+            self.exact = NearestNeighbors(algorithm='ball_tree').fit(self.X)
+
+        return self.exact
+
+    def kneighbors(self, X, n_neighbors):
+
+        """
+        Inputs:
+            X: query rows
+            n_neighbors: number of neighbours
+
+        Output: distances and positions of the (approximate) nearest neighbours of each row
+        """
+
+        X = np.asarray(X, dtype=np.float64)
+
+        distances = np.empty((len(X), n_neighbors))
+        indices = np.empty((len(X), n_neighbors), dtype=np.int64)
+
+        # Candidates gathered and ranked for a chunk of queries at a time
+        for start in range(0, len(X), self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            distances[chunk], indices[chunk] = self._kneighbors_chunk(X[chunk], n_neighbors)
+
+        return distances, indices
+
+
+class BallTreeImputer:
+
+    """
+    Imputes a target with the mean of its nearest neighbours among the training rows.
+    The neighbour index is fitted once and queried for any number of rows (validation, test, new claims).
+
+    Inputs:
+        n_neighbors: number of neighbours to be used
+        chunk_size: rows queried at a time (bounds the memory of the neighbour indices)
+        n_jobs: parallel jobs of each query with the ball tree (None for 1, -1 for all cores)
+        backend: 'ball_tree' for the exact neighbours, 'random_projection' for approximate
+                 neighbours (see RandomProjectionIndex)
+        n_components: number of dimensions the features are reduced to (Gaussian random
+                      projection) before the distances are computed, None to keep them all
+        index_params: parameters of the approximate index
+        random_state: random_state parameter
+    """
+
+    def __init__(self, n_neighbors = 5, chunk_size = 10000, n_jobs = None,
+                 backend = 'ball_tree', n_components = None, index_params = None, random_state = 0):
+
+        self.n_neighbors = n_neighbors
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.n_components = n_components
+        self.index_params = index_params
+        self.random_state = random_state
+
+    def fit(self, X, y):
+
+        """
+        Inputs:
+            X: features of the training rows
+            y: target of the training rows (missing values are left out of the index)
+
+        Output: fitted imputer
+        """
+
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        known = ~np.isnan(y)
+
+        # Reduced dimension for the distances
+        self.projection = None
+        if self.n_components is not None and self.n_components < X.shape[1]:
+            rng = np.random.default_rng(self.random_state)
+            self.projection = rng.normal(size=(X.shape[1], self.n_components)) / np.sqrt(self.n_components)
+
+        if self.backend == 'ball_tree':
+            self.index = NearestNeighbors(n_neighbors=self.n_neighbors, algorithm='ball_tree', n_jobs=self.n_jobs)
+        elif self.backend == 'random_projection':
+            params = dict({'random_state': self.random_state}, **(self.index_params or {}))
+            self.index = RandomProjectionIndex(**params)
+        else:
+            raise ValueError(f"Unknown backend '{self.backend}', use 'ball_tree' or 'random_projection'")
+
+        self.index.fit(self._project(X[known]))
+        self.values = y[known]
+
+        return self
+
+    def _project(self, X):
+        return X if self.projection is None else X @ self.projection
+
+    def kneighbors(self, X):
+
+        """
+        Input:
+            X: features of the rows
+
+        Output: distances and positions (among the known training rows) of the nearest neighbours
+        """
+
+        return self.index.kneighbors(self._project(np.asarray(X, dtype=np.float64)), self.n_neighbors)
+
+    def predict(self, X):
+
+        """
+        Input:
+            X: features of the rows to impute
+
+        Output: mean target of the nearest training neighbours of each row
+        """
+
+        X = np.asarray(X, dtype=np.float64)
+        means = np.empty(len(X))
+
+        for start in range(0, len(X), self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            _, indices = self.kneighbors(X[chunk])
+
+            # One gather over the index matrix for every row of the chunk
+            means[chunk] = self.values[indices].mean(axis=1)
+
+        return means
+
+    def fill(self, X, y):
+
+        """
+        Inputs:
+            X: features of the rows
+            y: target of the rows, filled in place where missing (numpy array)
+
+        Output: filled target
+        """
+
+        missing = np.isnan(y)
+
+        if missing.any():
+            y[missing] = self.predict(np.asarray(X)[missing])
+
+        return y
+
+
 def ball_tree_impute(dfs, target, n_neighbors=5):
 
     """
@@ -180,37 +681,26 @@ def ball_tree_impute(dfs, target, n_neighbors=5):
         target: variable we want to fill, in this case it will be used for Average Weekly Wage
         n_neighbors: number of neighbours to be used
 
-    Output: target
+    Output: target (each dataframe is filled from its own rows, see BallTreeImputer to fit
+            on the training rows once and fill other dataframes from them)
     """
 
     for df in dfs:
-
         # Get all features except the target
-        features = df.columns.drop(target)
-
-        # Separate rows with and without missing target values
-        missing_mask = df[target].isna()
-        non_missing_data = df[~missing_mask]
-        missing_data = df[missing_mask]
+        features = df[df.columns.drop(target)].to_numpy(dtype=np.float64, na_value=np.nan)
+        values = df[target].to_numpy(dtype=np.float64, na_value=np.nan, copy=True)
 
-        # Model
-        knn = NearestNeighbors(n_neighbors=n_neighbors, algorithm='ball_tree')
-        knn.fit(non_missing_data[features])
+        # Fill the missing target from the rows where it is known
+        imputer = BallTreeImputer(n_neighbors=n_neighbors).fit(features, values)
+        df[target] = imputer.fill(features, values)
 
-        # Find nearest neighbors for rows with missing values
-        _, indices = knn.kneighbors(missing_data[features])
 
-        # Initialize a Series to store imputed values
-        imputed_values = pd.Series(index=df.index)
-
-        # Impute missing values by averaging the target values of nearest neighbors
-        for i, neighbor_indices in enumerate(indices):
-            # Calculate the mean of the neighbors' target values
-            mean_value = non_missing_data.iloc[neighbor_indices][target].mean()
-            imputed_values[missing_data.index[i]] = mean_value
-
-        # Combine the imputed values with the original target values
-        df[target] = df[target].combine_first(imputed_values)
+# Dates (end, start) of the time columns, as originally computed
+TIME_INTERVALS = {
+    'Accident to Assembly Time': ('Assembly Date', 'Accident Date'),
+    'Assembly to C-2 Time': ('Assembly Date', 'C-2 Date'),
+    'Accident to C-2 Time': ('C-2 Date', 'Assembly Date'),
+}
 
 
 def fill_missing_times(df, cols):
@@ -223,47 +713,14 @@ def fill_missing_times(df, cols):
     Output: dataframe with filled columns
     """
 
-    # Recompute Dates
-    df['Accident Date'] = pd.to_datetime(
-        df['Accident Date Year'].astype(str) + '-' +
-        df['Accident Date Month'].astype(str).str.zfill(2) + '-' + 
-        df['Accident Date Day'].astype(str).str.zfill(2),
-        errors='coerce'
-    )
-    
-    df['Assembly Date'] = pd.to_datetime(
-        df['Assembly Date Year'].astype(str) + '-' +
-        df['Assembly Date Month'].astype(str).str.zfill(2) + '-' +
-        df['Assembly Date Day'].astype(str).str.zfill(2),
-        errors='coerce'
-    )
-    
-    df['C-2 Date'] = pd.to_datetime(
-        df['C-2 Date Year'].astype(str) + '-' +
-        df['C-2 Date Month'].astype(str).str.zfill(2) + '-' +
-        df['C-2 Date Day'].astype(str).str.zfill(2),
-        errors='coerce'
-    )
-    
-    
-    for col in cols:
+    # Days between the dates rebuilt from their parts, each date built once
+    features = d.date_features(df, intervals = {col: TIME_INTERVALS[col] for col in cols if col in TIME_INTERVALS})
 
-        # Fill Columns
-        if col == 'Accident to Assembly Time':
-            df['Accident to Assembly Time'] = df['Accident to Assembly Time'].fillna(
-                (df['Assembly Date'] - df['Accident Date']).dt.days)
+    for col, days in features.items():
 
-        if col == 'Assembly to C-2 Time':
-            df['Assembly to C-2 Time'] = df['Assembly to C-2 Time'].fillna(
-                (df['Assembly Date'] - df['C-2 Date']).dt.days)
-
-        if col == 'Accident to C-2 Time':
-            df['Accident to C-2 Time'] = df['Accident to C-2 Time'].fillna(
-                (df['C-2 Date'] - df['Assembly Date']).dt.days)
+        # Fill Columns
+        df[col] = df[col].fillna(pd.Series(days, index=df.index))
 
-    # Drop recomputed and temporary Dates
-    df.drop(['Accident Date', 'Assembly Date', 'C-2 Date'], axis = 1, inplace = True)        
-            
     return df
 
 
@@ -329,3 +786,69 @@ def detect_outliers_iqr(df, threshold):
     print(outliers)
     
     return bounds  
+
+
+## MEMORY
+
+def compact_column(values, max_categories = 0.5):
+
+    """
+    Inputs:
+        values: column (series)
+        max_categories: text columns with fewer distinct values than this fraction of the rows
+                        are stored as category
+
+    Output: column in the smallest dtype holding its values
+            (uint8 flags, int8/int16/int32 codes, float32 numerics, category text)
+    """
+
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values
+
+    if pd.api.types.is_bool_dtype(values):
+        return values.astype('uint8')
+
+    if pd.api.types.is_integer_dtype(values):
+        # Nullable integers (e.g. Int64 from fill_dates) with missing values become float32
+        if values.isna().any():
+            return values.astype('float32')
+
+        values = values.astype('int64')
+        if len(values) and values.min() >= 0 and values.max() <= 1:
+            return values.astype('uint8')
+        return pd.to_numeric(values, downcast='integer')
+
+    if pd.api.types.is_float_dtype(values):
+        return values.astype('float32')
+
+    if pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+        if values.nunique() < max_categories * len(values):
+            return values.astype('category')
+
+    return values
+
+
+def compact_dtypes(df, max_categories = 0.5):
+
+    """
+    Inputs:
+        df: dataframe
+        max_categories: see compact_column
+
+    Output: dataframe with the smallest dtypes holding its values
+    """
+
+    return pd.DataFrame({column: compact_column(values, max_categories) for column, values in df.items()},
+                        index=df.index)
+
+
+def memory_mb(df):
+
+    """
+    Input:
+        df: dataframe
+
+    Output: memory used by the dataframe, in MB
+    """
+
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
@@ -1,26 +1,63 @@
+import time
+start_time = time.perf_counter()
+
+import logging
+import os
 import streamlit as st
 from streamlit_option_menu import option_menu
-from PIL import Image
-import pickle
-import gzip
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import plotly_express as px
-import seaborn as sns
-from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
-from sklearn.ensemble import RandomForestClassifier
-from predict import show_predict
 
+# Heavy modules (pandas, plotting, sklearn, xgboost) are imported only by the pages that need them
+
+# Time to first Home render (seconds), and the CSV file the measurements are appended to
+# (only if the STARTUP_LOG environment variable is set)
+STARTUP_BUDGET = 2.0
+STARTUP_LOG = os.environ.get("STARTUP_LOG")
+
+logger = logging.getLogger(__name__)
+
+
+# Start of the first script run of the server (reruns keep it), and whether startup was tracked
+@st.cache_resource
+def startup_state():
+    return {"start_time": start_time, "tracked": False}
+
+
+# Load the logos once per server
+@st.cache_resource
+def load_images():
+    from PIL import Image
+
+    img = Image.open("./24_Nexus_Analytics.png")
+    logo = Image.open("./Nova_IMS.png")
+    img.load()
+    logo.load()
 
+    return img, logo
 
-# Load the logo
-img = Image.open("./24_Nexus_Analytics.png")
-logo = Image.open("./Nova_IMS.png")
 
-#load Data for vizualizations 
-df= pd.read_csv("./train_data_EDA.csv")
-county_df = pd.read_csv("./geo_county.csv")
+def track_startup(elapsed_time):
+
+    """
+    Input:
+        elapsed_time: seconds from the start of the script to the first Home render
+
+    Output: measurement logged (and appended to STARTUP_LOG if set), warning if over STARTUP_BUDGET
+    """
+
+    if STARTUP_LOG:
+        new_file = not os.path.exists(STARTUP_LOG)
+        with open(STARTUP_LOG, "a") as f:
+            if new_file:
+                f.write("timestamp,seconds,budget\n")
+            f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')},{elapsed_time:.3f},{STARTUP_BUDGET}\n")
+
+    if elapsed_time > STARTUP_BUDGET:
+        logger.warning("Startup took %.2fs, over the %.1fs budget", elapsed_time, STARTUP_BUDGET)
+    else:
+        logger.info("Startup took %.2fs", elapsed_time)
+
+
+img, logo = load_images()
 
 # Define the navigation menu
 def streamlit_menu():
@@ -91,6 +128,7 @@ if selected == "Home":
         }
 
         # Transform the Dict in a pandas data frame
+        import pandas as pd
         metadata_df = pd.DataFrame(list(metadata.items()), columns=["Attribute", "Description"])
         
         # Display the table
@@ -99,6 +137,12 @@ if selected == "Home":
     # Display the logo below the team section
     st.image(img, use_container_width=True)
 
+    # Measure the first Home render of the server, from its first script run (cold start)
+    startup = startup_state()
+    if not startup["tracked"]:
+        startup["tracked"] = True
+        track_startup(time.perf_counter() - startup["start_time"])
+
 #Inputs and Predictions Page 
 if selected == "Inputs and Prediction":
     st.title("Predict Compensation Benefit")
@@ -107,52 +151,89 @@ if selected == "Inputs and Prediction":
     )
 
     # Run the function of Predictions
+    from predict import show_predict
     show_predict()
 
 # Explore Data Page 
 if selected == "Explore Data":
+    import matplotlib.pyplot as plt
+    import plotly_express as px
+    import seaborn as sns
+    import data as d
+
     st.title("Model Data and Insights")
     st.subheader("Analyse the pairwise relation between the numerical features")
 
     
     # Create the list of numeric features 
     numeric_features = ['Age at Injury', 'Average Weekly Wage', 'Birth Year', 'IME-4 Count','Industry Code','WCIO Cause of Injury Code', 'WCIO Nature of Injury Code', 'WCIO Part Of Body Code', 'Number of Dependents']
+
+    # Columns used in this page (only these are loaded)
+    columns = tuple(numeric_features + ['Claim Injury Type'])
+    county_df = d.load_counties()
+
+    # Precomputed bin counts of the numeric features (overall and per Claim Injury Type)
+    cube = d.hist_cube(tuple(numeric_features))
     
     # Defining and calling the function for an interactive scatterplot
-    def interactive_scater (dataframe):
+    def interactive_scater (columns):
         x_axis_val = st.selectbox('Select X-Axis Value', options=numeric_features)
         y_axis_val = st.selectbox('Select Y-Axis Value', options=numeric_features)
         col = st.color_picker('Select a plot colour')
 
-        plot  = px.scatter(dataframe, x=x_axis_val, y=y_axis_val)
-        plot.update_traces(marker = dict(color=col))
+        # Downsampled points and density grid, computed once per (x, y) pair
+        scatter = d.scatter_data(x_axis_val, y_axis_val, columns)
+
+        # Above the threshold the density view is shown by default
+        view = st.radio('View', ['Points', 'Density'], horizontal=True,
+                        index=int(scatter['n_rows'] > d.DENSITY_THRESHOLD))
+
+        if view == 'Points':
+            points = scatter['points']
+            if len(points) < scatter['n_rows']:
+                st.caption(f"Showing {len(points):,} of {scatter['n_rows']:,} claims (stratified sample with outliers kept)")
+
+            plot  = px.scatter(points, x=x_axis_val, y=y_axis_val)
+            plot.update_traces(marker = dict(color=col))
+        else:
+            counts, x_centers, y_centers = scatter['grid']
+            plot = px.imshow(counts, x=x_centers, y=y_centers, origin='lower', aspect='auto',
+                             color_continuous_scale=['white', col],
+                             labels=dict(x=x_axis_val, y=y_axis_val, color='Claims'))
+
         st.plotly_chart(plot)
 
-    interactive_scater (df)
+    interactive_scater (columns)
 
     st.divider()
     
     #Creating Hist of numerical
     st.subheader("Analyse the histograms of Numerical features") 
 
-    def interactive_hist (dataframe):
+    def interactive_hist (cube):
         box_hist = st.selectbox('Feature', options=numeric_features)
         color_choice = st.color_picker('Select a plot colour', '#1f77b4')
         bin_count = st.slider('Select number of bins', min_value=5, max_value=100, value=20, step=1)
 
-        hist  = sns.displot(dataframe[box_hist], color=color_choice, bins=bin_count)
-        
+        # Re-bin the precomputed counts instead of the raw data
+        edges, counts = d.rebin(cube[box_hist]['edges'], cube[box_hist]['counts'], bin_count)
+
+        hist, ax = plt.subplots()
+        ax.hist(edges[:-1], bins=edges, weights=counts, color=color_choice, edgecolor='white')
+        ax.set_xlabel(box_hist)
+        ax.set_ylabel('Count')
+
         plt.title(f"Histogram of {box_hist}")
         st.pyplot(hist)
 
         
-    interactive_hist(df)
+    interactive_hist(cube)
 
     st.divider()
     
     st.subheader("Numerical features against Target Variable (Claim Injury Type)")
 
-    def hist_target(dataframe):
+    def hist_target(cube):
          # Reverse the encoding in the target column
         label_mapping = { 
         0: "1. CANCELLED",
@@ -165,27 +246,34 @@ if selected == "Explore Data":
         7: "8. DEATH"   
     }
     
-        # Map the numeric Claim Injury Type to descriptive labels
-        dataframe['Claim Injury Type Label'] = dataframe['Claim Injury Type'].map(label_mapping)
-
-        # Reverse the encoding in the target column
-        target_var = dataframe['Claim Injury Type']
-    
         # Create a dropdown for selecting numeric features
         target_hist = st.selectbox('Feature', options=numeric_features, key="numeric_feature_hist")
     
         # Create a dropdown for selecting the number of bins
         bin_count = st.slider('Select number of bins', min_value=5, max_value=100, value=30, key="bin_slider")
 
-        color_palette = "inferno"
+        color_palette = sns.color_palette("inferno", len(cube[target_hist]['classes']))
+
+        # Re-bin the precomputed counts of each class
+        fine_edges = cube[target_hist]['edges']
+        edges, class_counts = d.rebin(fine_edges, cube[target_hist]['class_counts'], bin_count)
+
+        # Plot the histogram and the KDE (computed from the fine bins) of each class
+        fig, ax = plt.subplots(figsize=(10, 6))
+        for i, target_class in enumerate(cube[target_hist]['classes']):
+            label = label_mapping.get(target_class, target_class)
+            ax.hist(edges[:-1], bins=edges, weights=class_counts[i], color=color_palette[i], alpha=0.5, label=label)
+
+            grid, kde = d.binned_kde(fine_edges, cube[target_hist]['class_counts'][i], edges[1] - edges[0])
+            ax.plot(grid, kde, color=color_palette[i])
 
-        # Plot the histogram
-        plt.figure(figsize=(10, 6))
-        sns.histplot(data=dataframe, x=target_hist, hue="Claim Injury Type Label", kde=True, bins=bin_count, palette=color_palette)
+        ax.set_xlabel(target_hist)
+        ax.set_ylabel('Count')
+        ax.legend(title="Claim Injury Type Label")
         plt.title(f"Distribution of {target_hist} by Claim Injury Type")
-        st.pyplot(plt)
+        st.pyplot(fig)
     
-    hist_target(df)
+    hist_target(cube)
 
     st.divider()
     
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import numbers
+import threading
+import time
+from collections import OrderedDict
+
+import streamlit as st
+
+
+class PredictionCache:
+
+    """
+    Bounded LRU cache of predictions with a time to live, safe to share between sessions.
+
+    Inputs:
+        max_size: maximum number of predictions kept (least recently used are dropped)
+        ttl: seconds a prediction stays valid
+    """
+
+    def __init__(self, max_size = 1024, ttl = 3600):
+
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+
+        """
+        Input:
+            key: output of make_key
+
+        Output: cached prediction, None if missing or expired
+        """
+
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+
+            value, expires_at = item
+            if time.monotonic() > expires_at:
+                del self._items[key]
+                return None
+
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + self.ttl)
+            self._items.move_to_end(key)
+
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+def canonical(value):
+
+    """
+    Input:
+        value: field of the form
+
+    Output: JSON friendly value, equal for inputs that lead to the same prediction
+    """
+
+    if value is None or value != value:
+        # None, NaN and NaT
+        return None
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, numbers.Number):
+        return float(value)
+
+    return str(value).strip()
+
+
+def make_key(input_data, model_id, ignore = ('Claim Identifier',)):
+
+    """
+    Inputs:
+        input_data: dictionary with the claim fields built in show_predict
+        model_id: id of the fitted artifact (the cache is invalidated when it changes)
+        ignore: fields that do not change the prediction
+
+    Output: stable hash of the claim and the model
+    """
+
+    fields = {field: canonical(value) for field, value in input_data.items() if field not in ignore}
+    payload = json.dumps({'model': model_id, 'claim': fields}, sort_keys=True)
+
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+@st.cache_resource
+def get_prediction_cache():
+    # One cache per server, shared by every session
+    return PredictionCache()
@@ -0,0 +1,356 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+
+# Paths of the training data and of its columnar cache
+TRAIN_PATH = './train_data_EDA.csv'
+CACHE_PATH = './train_data_EDA.feather'
+COUNTY_PATH = './geo_county.csv'
+
+# Compact dtypes for the columns used by the app
+dtypes = {
+    'County of Injury': 'category',
+    'Carrier Name': 'category',
+    'District Name': 'category',
+    'Claim Injury Type': 'int8',
+    'Age at Injury': 'float32',
+    'Average Weekly Wage': 'float32',
+    'Birth Year': 'float32',
+    'IME-4 Count': 'float32',
+    'Number of Dependents': 'float32',
+    'Industry Code': 'float32',
+    'WCIO Cause of Injury Code': 'float32',
+    'WCIO Nature of Injury Code': 'float32',
+    'WCIO Part Of Body Code': 'float32'
+}
+
+
+def downcast(df):
+
+    """
+    Input:
+        df: dataframe with float32 columns
+
+    Output: dataframe where float columns holding only whole numbers (no missing values)
+            are stored as the smallest integer type (int8/int16)
+    """
+
+    for col in df.select_dtypes(include='float').columns:
+        values = df[col]
+        if values.notna().all() and (values % 1 == 0).all():
+            df[col] = pd.to_numeric(values, downcast='integer')
+
+    return df
+
+
+def read_train_csv(columns = None, path = TRAIN_PATH):
+
+    """
+    Inputs:
+        columns: columns to read (all if None)
+        path: path to train_data_EDA.csv
+
+    Output: training data with compact dtypes
+    """
+
+    usecols = None if columns is None else list(columns)
+
+    df = pd.read_csv(path, usecols=usecols,
+                     dtype={col: dtype for col, dtype in dtypes.items()
+                            if usecols is None or col in usecols})
+
+    return downcast(df)
+
+
+def build_cache(path = TRAIN_PATH, cache_path = CACHE_PATH):
+
+    """
+    Inputs:
+        path: path to train_data_EDA.csv
+        cache_path: path of the Feather cache
+
+    Output: True if the cache was (re)built, False if Feather is not available
+    """
+
+    try:
+        import pyarrow.feather as feather
+    except ImportError:
+        return False
+
+    # Rebuild only if missing or older than the CSV
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        return True
+
+    df = read_train_csv(path=path)
+
+    # Written to a temporary file first, so readers never see a partial cache
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_path)), suffix='.tmp')
+    os.close(fd)
+
+    try:
+        feather.write_feather(df, tmp_path)
+        os.replace(tmp_path, cache_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return True
+
+
+@st.cache_resource
+def load_train(columns = None):
+
+    """
+    Input:
+        columns: tuple with the columns needed by the page (all if None)
+
+    Output: training data, shared (read-only) across reruns and sessions
+    """
+
+    if build_cache():
+        import pyarrow.feather as feather
+
+        # Only the requested columns are read from the memory-mapped file
+        table = feather.read_table(CACHE_PATH, columns=None if columns is None else list(columns),
+                                   memory_map=True)
+        return table.to_pandas()
+
+    return read_train_csv(columns)
+
+
+@st.cache_resource
+def load_counties(path = COUNTY_PATH):
+    return pd.read_csv(path)
+
+
+## HISTOGRAMS
+
+# Number of fine bins stored per feature (any coarser bin count is derived from them)
+FINE_BINS = 1000
+
+
+@st.cache_resource
+def hist_cube(columns, target = 'Claim Injury Type'):
+
+    """
+    Inputs:
+        columns: tuple with the numeric features
+        target: column used to split the counts by class
+
+    Output: dictionary with, for each feature, the fine bin edges, the overall counts
+            and the counts per class (classes x FINE_BINS)
+    """
+
+    df = load_train(tuple(columns) + (target,))
+    classes = np.sort(df[target].unique())
+    class_idx = np.searchsorted(classes, df[target].to_numpy())
+
+    cube = {}
+    for col in columns:
+        values = df[col].to_numpy(dtype='float64')
+        valid = ~np.isnan(values)
+
+        lower, upper = values[valid].min(), values[valid].max()
+        if upper == lower:
+            upper = lower + 1
+        edges = np.linspace(lower, upper, FINE_BINS + 1)
+
+        # Fine bin of every value, counted once per (class, bin)
+        bin_idx = np.clip(((values[valid] - lower) / (upper - lower) * FINE_BINS).astype(int),
+                          0, FINE_BINS - 1)
+        class_counts = np.bincount(class_idx[valid] * FINE_BINS + bin_idx,
+                                   minlength=len(classes) * FINE_BINS).reshape(len(classes), FINE_BINS)
+
+        cube[col] = {'edges': edges,
+                     'counts': class_counts.sum(axis=0),
+                     'class_counts': class_counts,
+                     'classes': classes}
+
+    return cube
+
+
+def rebin(edges, counts, bins):
+
+    """
+    Inputs:
+        edges: fine bin edges
+        counts: fine bin counts (1d, or 2d with one row per class)
+        bins: number of bins selected by the user
+
+    Output: coarse bin edges and counts
+    """
+
+    new_edges = np.linspace(edges[0], edges[-1], bins + 1)
+
+    # Cumulative counts at the coarse edges, a fine bin cut by a coarse edge is split in
+    # proportion to the overlap (values assumed uniform within a fine bin)
+    cumulative = np.concatenate([np.zeros(counts.shape[:-1] + (1,)), np.cumsum(counts, axis=-1)], axis=-1)
+
+    if counts.ndim == 1:
+        return new_edges, np.diff(np.interp(new_edges, edges, cumulative))
+
+    new_counts = np.stack([np.diff(np.interp(new_edges, edges, row_cumulative))
+                           for row_cumulative in cumulative])
+
+    return new_edges, new_counts
+
+
+def binned_kde(edges, counts, bin_width):
+
+    """
+    Inputs:
+        edges: fine bin edges
+        counts: fine bin counts
+        bin_width: width of the displayed bins (to scale the curve to the histogram counts)
+
+    Output: x grid and KDE curve (Gaussian kernel, Scott's bandwidth), computed from the bins
+    """
+
+    centers = (edges[:-1] + edges[1:]) / 2
+    n = counts.sum()
+
+    if n < 2:
+        return centers, np.zeros_like(centers)
+
+    # Bandwidth from the binned mean and variance
+    mean = np.average(centers, weights=counts)
+    std = np.sqrt(np.average((centers - mean) ** 2, weights=counts))
+    fine_width = edges[1] - edges[0]
+    bandwidth = max(std * n ** (-1 / 5), fine_width) / fine_width
+
+    # Convolve the counts with a Gaussian kernel expressed in fine bins
+    half_width = min(int(4 * bandwidth), (len(counts) - 1) // 2)
+    offsets = np.arange(-half_width, half_width + 1)
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2)
+    kernel /= kernel.sum()
+
+    density = np.convolve(counts, kernel, mode='same') / (n * fine_width)
+
+    return centers, density * n * bin_width
+
+
+## SCATTER
+
+# Maximum number of points sent to the browser and size of the density grid
+MAX_POINTS = 20000
+DENSITY_THRESHOLD = 200000
+GRID_SIZE = 100
+
+
+def downsample(df, x, y, target = 'Claim Injury Type', max_points = MAX_POINTS, random_state = 42):
+
+    """
+    Inputs:
+        df: training data
+        x, y: features of the scatter plot
+        target: column used to stratify the sample
+        max_points: maximum number of points to keep
+        random_state: random_state parameter
+
+    Output: at most max_points rows: the most extreme outliers (up to 10% of the points)
+            plus a random sample stratified by target
+    """
+
+    # x and y can be the same feature
+    data = df[list(dict.fromkeys([x, y, target]))].dropna(subset=[x, y])
+
+    if len(data) <= max_points:
+        return data
+
+    # Distance beyond the 1.5 IQR fences, in IQRs (0 for non outliers)
+    score = np.zeros(len(data))
+    for col in dict.fromkeys([x, y]):
+        values = data[col].to_numpy(dtype='float64')
+        q1, q3 = np.percentile(values, [25, 75])
+        iqr = q3 - q1 if q3 > q1 else 1.0
+        excess = np.maximum(q1 - 1.5 * iqr - values, values - q3 - 1.5 * iqr)
+        score = np.maximum(score, excess / iqr)
+
+    n_outliers = min(int((score > 0).sum()), max_points // 10)
+    outlier_pos = np.argsort(-score)[:n_outliers]
+    outliers = data.iloc[outlier_pos]
+
+    # Stratified random sample of the remaining rows
+    rest = data.drop(outliers.index)
+    frac = (max_points - n_outliers) / len(rest)
+    sample = rest.groupby(target, group_keys=False, observed=True).sample(frac=frac, random_state=random_state)
+
+    return pd.concat([outliers, sample])
+
+
+def density_grid(df, x, y, grid_size = GRID_SIZE):
+
+    """
+    Inputs:
+        df: training data
+        x, y: features of the plot
+        grid_size: number of cells per axis
+
+    Output: counts (grid_size x grid_size, rows are y) and the cell centers of each axis
+    """
+
+    # Same feature on both axes: every point lies on the diagonal
+    if x == y:
+        counts, edges = np.histogram(df[x].dropna().to_numpy(dtype='float64'), bins=grid_size)
+        centers = (edges[:-1] + edges[1:]) / 2
+        return np.diag(counts).astype('float64'), centers, centers
+
+    data = df[[x, y]].dropna()
+
+    counts, x_edges, y_edges = np.histogram2d(data[x].to_numpy(dtype='float64'),
+                                              data[y].to_numpy(dtype='float64'),
+                                              bins=grid_size)
+
+    return counts.T, (x_edges[:-1] + x_edges[1:]) / 2, (y_edges[:-1] + y_edges[1:]) / 2
+
+
+@st.cache_resource
+def scatter_data(x, y, columns):
+
+    """
+    Inputs:
+        x, y: features of the scatter plot (cache key)
+        columns: tuple with the columns loaded for the page
+
+    Output: dictionary with the number of rows, the downsampled points and the density grid
+    """
+
+    df = load_train(columns)
+
+    return {'n_rows': int(df[[x, y]].notna().all(axis=1).sum()),
+            'points': downsample(df, x, y),
+            'grid': density_grid(df, x, y)}
+
+
+def check_scatter(n_rows = 50000, random_state = 42):
+
+    """
+    Inputs:
+        n_rows: rows of the synthetic data (above MAX_POINTS, so it is downsampled)
+        random_state: random_state parameter
+
+    Output: None, raises AssertionError if downsample or density_grid fail for a pair of
+            features, the same feature on both axes included
+    """
+
+    rng = np.random.default_rng(random_state)
+    df = pd.DataFrame({'Age at Injury': rng.normal(40, 12, n_rows),
+                       'Average Weekly Wage': rng.lognormal(6, 1, n_rows),
+                       'Claim Injury Type': rng.integers(0, 8, n_rows)})
+
+    for x, y in [('Age at Injury', 'Average Weekly Wage'), ('Age at Injury', 'Age at Injury')]:
+        points = downsample(df, x, y)
+        assert len(points) <= MAX_POINTS and list(points.columns) == list(dict.fromkeys([x, y, 'Claim Injury Type']))
+
+        counts, x_centers, y_centers = density_grid(df, x, y)
+        assert counts.shape == (GRID_SIZE, GRID_SIZE) and counts.sum() == n_rows
+
+
+if __name__ == '__main__':
+
+    # python data.py: regression check of the scatter data on synthetic claims
+    check_scatter()
+    print('Scatter data checks passed')
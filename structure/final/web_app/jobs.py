@@ -0,0 +1,140 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+
+# Stages reported by the prediction path, in the order they run
+STAGES = ['load', 'encode', 'scale', 'impute', 'predict']
+
+
+class JobManager:
+
+    """
+    Runs prediction jobs in a thread pool so they survive Streamlit reruns
+    and do not block the script thread of any session.
+
+    Inputs:
+        max_workers: number of jobs running at the same time
+        max_jobs: number of jobs kept in memory (oldest finished jobs are dropped)
+    """
+
+    def __init__(self, max_workers = 2, max_jobs = 1000):
+
+        self.max_jobs = max_jobs
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+
+        """
+        Inputs:
+            fn: function to run, called as fn(*args, progress=callback, **kwargs)
+            args, kwargs: arguments of fn
+
+        Output: job id
+        """
+
+        job = {'id': uuid.uuid4().hex,
+               'status': 'queued',
+               'stage': None,
+               'timings': {},
+               'result': None,
+               'error': None,
+               'submitted_at': time.time()}
+
+        with self._lock:
+            self._jobs[job['id']] = job
+            self._prune()
+
+        self._executor.submit(self._run, job, fn, args, kwargs)
+
+        return job['id']
+
+    def add_done(self, result):
+
+        """
+        Input:
+            result: result obtained without running a job (e.g. from a cache)
+
+        Output: id of a finished job holding the result
+        """
+
+        job = {'id': uuid.uuid4().hex,
+               'status': 'done',
+               'stage': None,
+               'timings': {},
+               'result': result,
+               'error': None,
+               'submitted_at': time.time()}
+
+        with self._lock:
+            self._jobs[job['id']] = job
+            self._prune()
+
+        return job['id']
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+
+        # Drop the oldest finished jobs once there are too many
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] in ('done', 'failed')]
+        for job_id in finished[:max(len(self._jobs) - self.max_jobs, 0)]:
+            del self._jobs[job_id]
+
+    def _run(self, job, fn, args, kwargs):
+
+        stage_start = [time.perf_counter()]
+
+        def progress(stage):
+            # Close the previous stage and start the new one
+            now = time.perf_counter()
+            if job['stage'] is not None:
+                job['timings'][job['stage']] = now - stage_start[0]
+            job['stage'] = stage
+            stage_start[0] = now
+
+        job['status'] = 'running'
+
+        try:
+            job['result'] = fn(*args, progress=progress, **kwargs)
+            job['status'] = 'done'
+        except Exception as error:
+            job['error'] = error
+            job['status'] = 'failed'
+        finally:
+            if job['stage'] is not None:
+                job['timings'][job['stage']] = time.perf_counter() - stage_start[0]
+
+
+def fraction_done(job):
+
+    """
+    Input:
+        job: job dictionary
+
+    Output: progress between 0 and 1
+    """
+
+    if job['status'] == 'done':
+        return 1.0
+    if job['stage'] is None:
+        return 0.0
+
+    # Stages outside STAGES (e.g. from a profiled run) count as the start
+    stage = job['stage']
+    return (STAGES.index(stage) if stage in STAGES else 0) / len(STAGES)
+
+
+@st.cache_resource
+def get_jobs():
+    # One job manager per server, shared by every session
+    return JobManager()
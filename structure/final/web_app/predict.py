@@ -1,19 +1,123 @@
 import streamlit as st
-from streamlit_option_menu import option_menu
-from PIL import Image
-import pickle
-import gzip
 import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
-from sklearn.ensemble import RandomForestClassifier
-from PIL import Image
-import datetime
-import preproc as p
+import os
+import io
+import time
+import hashlib
+import jobs as j
+import cache as c
 import mappings as mapp
 
+def to_date(year, month, day):
+
+    """
+    Inputs:
+        year, month, day: date selected in the form
+
+    Output: native datetime64 timestamp (NaT if the date does not exist, e.g. 31 of February)
+    """
+
+    try:
+        return pd.Timestamp(year, month, day)
+    except ValueError:
+        return pd.NaT
+
+
+def predict_and_cache(input_df, key, progress = None):
+
+    """
+    Inputs:
+        input_df: claim built from the form
+        key: prediction cache key (None to skip caching)
+        progress: callback with the name of each stage
+
+    Output: predicted Claim Injury Type and class probabilities, saved in the prediction cache
+    """
+
+    import preproc as p
+
+    result = p.predict_claim(input_df, progress)
+
+    if key is not None:
+        c.get_prediction_cache().put(key, result)
+
+    return result
+
+
+@st.cache_data(max_entries=4, show_spinner="Scoring the claims...")
+def score_upload(file_hash, model_id, _data):
+
+    """
+    Inputs:
+        file_hash, model_id: hash of the uploaded file and id of the artifact (cache key)
+        _data: content of the uploaded CSV file
+
+    Output: predictions of every claim and the time taken, computed once per file and model
+            (ValueError if the file is not a CSV with the fields of the form)
+    """
+
+    import preproc as p
+
+    claims = pd.read_csv(io.BytesIO(_data))
+
+    missing = [column for column in ['Claim Identifier'] if column not in claims.columns]
+    missing += p.missing_columns(claims)
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+    claims = claims.set_index('Claim Identifier')
+
+    start_time = time.perf_counter()
+    predictions = p.predict_batch(claims)
+    elapsed_time = time.perf_counter() - start_time
+
+    return predictions, elapsed_time
+
+
+def show_job(jobs, job_id):
+
+    """
+    Inputs:
+        jobs: job manager
+        job_id: id of the job stored in the session
+
+    Output: progress of the job while it runs, its result when it is done
+    """
+
+    running = jobs.get(job_id)['status'] in ('queued', 'running')
+
+    # Only this block is rerun while the job is running
+    @st.fragment(run_every=0.5 if running else None)
+    def job_status():
+        job = jobs.get(job_id)
+
+        if job['status'] in ('queued', 'running'):
+            stage = job['stage'] or 'queued'
+            st.progress(j.fraction_done(job), text=f"Running stage: {stage}")
+
+        elif job['status'] == 'done':
+            result = job['result']
+
+            st.subheader("Prediction Result")
+            st.write(f"The predicted compensation benefit is: {result['Claim Injury Type']}")
+            st.write(result.drop('Claim Injury Type').rename('Probability').to_frame())
+
+            if job['timings']:
+                timings = ', '.join(f"{stage} {seconds:.2f}s" for stage, seconds in job['timings'].items())
+                st.caption(f"Stages: {timings}")
+            else:
+                st.caption("Served from the prediction cache")
+
+        else:
+            st.error(f"The prediction failed: {job['error']}")
+
+        # Stop polling once the job is over: a full app rerun recomputes run_every
+        if running and job['status'] not in ('queued', 'running'):
+            st.rerun(scope='app')
+
+    job_status()
+
+
 def show_predict():
     # CLAIM DETAILS
     st.header("Claim Details")
@@ -252,10 +356,10 @@ def show_predict():
         "Average Weekly Wage": float(avg_weekly_wage),
         "Zip Code": int(zip_code),
         "Number of Dependents": int(n_dependents),
-        "Accident Date": datetime.date(accident_year, accident_month, accident_day),
-        "Assembly Date": datetime.date(assembly_year, assembly_month, assembly_day),
-        "C-2 Date": datetime.date(c2_year, c2_month, c2_day),
-        "C-3 Date": datetime.date(c3_year, c3_month, c3_day),
+        "Accident Date": to_date(accident_year, accident_month, accident_day),
+        "Assembly Date": to_date(assembly_year, assembly_month, assembly_day),
+        "C-2 Date": to_date(c2_year, c2_month, c2_day),
+        "C-3 Date": to_date(c3_year, c3_month, c3_day),
         "COVID-19 Indicator": str(covid),
         "Carrier Name": str(carrier_name),
         "Carrier Type": str(carrier_type),
@@ -263,7 +367,7 @@ def show_predict():
         "District Name": str(district),
         "Attorney/Representative": str(attorney),
         "Alternative Dispute Resolution": str(alternative_dispute),
-        "First Hearing Date": datetime.date(first_hearing_year, first_hearing_month, first_hearing_day),
+        "First Hearing Date": to_date(first_hearing_year, first_hearing_month, first_hearing_day),
         "IME-4 Count": int(ime_4_count),
         "Medical Fee Region": str(medical_region),
         "Industry Code": int(mapp.industry_code_mapping[industry]),
@@ -273,18 +377,66 @@ def show_predict():
         "WCIO Part Of Body Code": int(mapp.part_of_body_mapping[part_of_body])
         }
     
-    input_df = pd.DataFrame(input_data, index=[0])
+    input_df = pd.DataFrame(input_data, index=[0]).set_index('Claim Identifier')
 
     st.write(input_df)
 
     # Placeholder for prediction button
     st.subheader("Prediction")
+    jobs = j.get_jobs()
+
     if st.button("Predict"):
-        csv_path = "user_inputs.csv"
-        input_df.to_csv(csv_path, index=False)
-        st.success(f"User inputs saved to {csv_path}")
-
-        # Call the preprocessing and prediction function
-        prediction = p.preproc_(csv_path)
-        st.subheader("Prediction Result")
-        st.write(f"The predicted compensation benefit is: {prediction}")
\ No newline at end of file
+        # sklearn and xgboost are only imported once a prediction is requested
+        import preproc as p
+
+        # Same claim and same model -> cached result
+        key = None
+        if os.path.exists(p.ARTIFACT_PATH):
+            key = c.make_key(input_data, p.artifact_id())
+
+        result = c.get_prediction_cache().get(key) if key is not None else None
+
+        if result is not None:
+            st.session_state['job_id'] = jobs.add_done(result)
+        else:
+            # Queue the preprocessing and prediction (inputs are passed in memory) and return immediately
+            st.session_state['job_id'] = jobs.submit(predict_and_cache, input_df, key)
+
+    job_id = st.session_state.get('job_id')
+    if job_id is not None and jobs.get(job_id) is not None:
+        show_job(jobs, job_id)
+
+
+    # BATCH PREDICTION
+    st.subheader("Batch Prediction")
+    st.markdown("Upload a CSV file with one claim per row (same fields as the form above) to score them all at once.")
+
+    uploaded_file = st.file_uploader("Claims CSV", type="csv")
+
+    if uploaded_file is not None:
+        import preproc as p
+
+        try:
+            p.require_artifact()
+        except FileNotFoundError as error:
+            st.error(str(error))
+            st.stop()
+
+        # Scored once per file and model, not on every rerun of the page
+        data = uploaded_file.getvalue()
+        try:
+            predictions, elapsed_time = score_upload(hashlib.sha256(data).hexdigest(), p.artifact_id(), data)
+        except (KeyError, TypeError, ValueError) as error:
+            st.error(f"The file could not be scored: {error}")
+            st.stop()
+
+        st.success(f"Scored {len(predictions)} claims in {elapsed_time:.2f} seconds "
+                   f"({len(predictions) / max(elapsed_time, 1e-9):,.0f} rows/second)")
+        st.write(predictions)
+
+        st.download_button(
+            "Download Predictions",
+            data=predictions.to_csv().encode('utf-8'),
+            file_name="predictions.csv",
+            mime="text/csv",
+        )
@@ -1,44 +1,91 @@
 import pandas as pd
 import numpy as np
 import utils as u
-import utils2 as p
 import streamlit as st
 import datetime
+import gzip
+import os
+import pickle
+import tempfile
 
-# Scaler
-from sklearn.preprocessing import (
-    StandardScaler,
-    MinMaxScaler,
-    RobustScaler
-)
 # Train-Test Split
 from sklearn.model_selection import train_test_split
-# Models
-import models as mod
-from sklearn.ensemble import RandomForestClassifier
-from xgboost import XGBClassifier 
-
-
-def preproc_(path):
-    
-    user_input = pd.read_csv(path, index_col='Claim Identifier')
-
-    st.text("Processing your input data...")
+# Preprocessing shared with the cross-validation (from ../main, see shared.py)
+import shared
+from pipeline import ClaimsPreprocessor
+# Metrics
+from sklearn.metrics import f1_score
+# Shared predictor
+import serving
+# Profiling
+from profiler import StageProfiler, stage
+
+
+# Paths and version of the fitted artifact
+TRAIN_PATH = './train_data_EDA.csv'
+ARTIFACT_PATH = './model_artifact.pkl.gz'
+ARTIFACT_VERSION = 8
+
+# High-cardinality columns hashed instead of encoded with the training vocabulary
+# (Zip Code is used when the training data has it)
+HASH_BUCKETS = {'Carrier Name': 4096, 'Zip Code': 1024}
+
+# Fields of a claim (as in the form), besides its Claim Identifier
+INPUT_COLUMNS = ['Birth Year', 'Gender', 'Average Weekly Wage', 'Zip Code', 'Number of Dependents',
+                 'Accident Date', 'Assembly Date', 'C-2 Date', 'C-3 Date', 'COVID-19 Indicator',
+                 'Carrier Name', 'Carrier Type', 'County of Injury', 'District Name',
+                 'Attorney/Representative', 'Alternative Dispute Resolution', 'First Hearing Date',
+                 'IME-4 Count', 'Medical Fee Region', 'Industry Code', 'Industry Code Description',
+                 'WCIO Cause of Injury Code', 'WCIO Nature of Injury Code', 'WCIO Part Of Body Code']
+
+# Mapping
+label_mapping = {
+    0: "1. CANCELLED",
+    1: "2. NON-COMP",
+    2: "3. MED ONLY",
+    3: "4. TEMPORARY",
+    4: "5. PPD SCH LOSS",
+    5: "6. PPD NSL",
+    6: "7. PTD",
+    7: "8. DEATH"
+}
+
+def missing_columns(claims):
+
+    """
+    Input:
+        claims: raw claims
+
+    Output: fields of INPUT_COLUMNS the claims do not have
+    """
+
+    return [column for column in INPUT_COLUMNS if column not in claims.columns]
+
+
+def engineer_features(user_input):
+
+    """
+    Input:
+        user_input: raw claims, as submitted in the form
+
+    Output: claims with the same engineered features as train_data_EDA
+    """
 
     user_input['Age at Injury'] = 2024 - user_input['Birth Year']
 
     # List of columns to convert to datetime
     date_columns = ['Accident Date', 'Assembly Date', 'C-2 Date', 'C-3 Date', 'First Hearing Date']
 
-    # Apply pd.to_datetime() to each column in the list for both df and user_input
+    # Apply pd.to_datetime() to the columns that are not datetime64 yet (e.g. read from a CSV)
     for col in date_columns:
-        user_input[col] = pd.to_datetime(user_input[col], errors='coerce')
+        if not pd.api.types.is_datetime64_any_dtype(user_input[col]):
+            user_input[col] = pd.to_datetime(user_input[col], errors='coerce')
 
     mapping = {
     '5D. SPECIAL FUND - UNKNOWN': '5. SPECIAL FUND OR UNKNOWN',
     '5A. SPECIAL FUND - CONS. COMM. (SECT. 25-A)': '5. SPECIAL FUND OR UNKNOWN',
     '5C. SPECIAL FUND - POI CARRIER WCB MENANDS': '5. SPECIAL FUND OR UNKNOWN',
-    'UNKNOWN': '5. SPECIAL FUND OR UNKNOWN'}  
+    'UNKNOWN': '5. SPECIAL FUND OR UNKNOWN'}
 
     user_input['Carrier Type'] = user_input['Carrier Type'].replace(mapping)
 
@@ -51,7 +98,7 @@ def preproc_(path):
             user_input[f'{column} Year'] = user_input[column].dt.year
             user_input[f'{column} Month'] = user_input[column].dt.month
             user_input[f'{column} Day'] = user_input[column].dt.day
-            user_input[f'{column} Day of Week'] = user_input[column].dt.weekday 
+            user_input[f'{column} Day of Week'] = user_input[column].dt.weekday
 
     user_input['Accident to Assembly Time'] = (user_input['Assembly Date'] - user_input['Accident Date']).dt.days
 
@@ -69,287 +116,292 @@ def preproc_(path):
 
     user_input[columns_to_join] = user_input[columns_to_join].fillna(0).astype(int)
 
-    user_input['WCIO Codes'] = user_input[columns_to_join].astype(str).agg(''.join, axis=1).astype(int)
+    codes = user_input[columns_to_join].astype(str)
+    user_input['WCIO Codes'] = (codes[columns_to_join[0]] + codes[columns_to_join[1]]
+                                + codes[columns_to_join[2]]).astype(int)
 
     user_input['Insurance'] = user_input['Carrier Name'].str.contains('ins', case=False, na=False).astype(int)
 
     # Create a new column 'Zip Code Valid' to flag the validity of the 'Zip Code' field
-    user_input['Zip Code Valid'] = user_input['Zip Code'].apply(
-        lambda x: 2 if pd.isna(x)          
-        else (1 if not str(x).isnumeric()   
-            else 0)                       
-    )
+    # (2 if missing, 1 if not numeric, 0 otherwise)
+    zip_code = user_input['Zip Code']
+    if pd.api.types.is_numeric_dtype(zip_code):
+        numeric = zip_code.notna()
+    else:
+        numeric = zip_code.astype(str).str.isnumeric()
+
+    user_input['Zip Code Valid'] = np.where(zip_code.isna(), 2, np.where(numeric, 0, 1))
 
-    user_input['Industry Sector'] = user_input['Industry Code Description'].apply(u.group_industry)
+    # Group each distinct description once instead of once per row
+    industries = user_input['Industry Code Description']
+    sectors = {industry: u.group_industry(industry) for industry in industries.unique()}
+    user_input['Industry Sector'] = industries.map(sectors)
 
     bins = [-1, 17, 64, 117]
     labels = [0, 1, 2]
 
-    user_input['Age Group'] = pd.cut(user_input['Age at Injury'], 
+    user_input['Age Group'] = pd.cut(user_input['Age at Injury'],
                                     bins=bins, labels=labels, right=True)
-    
+
+    # Zip Code is kept for its hashed encoding (see HASH_BUCKETS)
     drop = ['Accident Date', 'Assembly Date',
-        'C-2 Date', 'Zip Code']
-    
+        'C-2 Date']
+
 
     user_input.drop(columns = drop, axis = 1, inplace = True)
 
+    return user_input
+
+
+## FIT
+
+def fit_artifact(train_path = TRAIN_PATH, artifact_path = ARTIFACT_PATH, random_state = 42):
+
+    """
+    Inputs:
+        train_path: path to train_data_EDA.csv
+        artifact_path: where to save the fitted artifact
+        random_state: random_state parameter
+
+    Output: fitted artifact (preprocessor and model), saved to artifact_path
+    """
+
     # Reading the train data
-    df= pd.read_csv("/Users/anaca/Documents/GitHub/machine_learning/web_app/train_data_EDA.csv",
-                    index_col='Claim Identifier')
-    
+    df = pd.read_csv(train_path, index_col='Claim Identifier')
+
     # Split the DataFrame into features (X) and target variable (y)
-    X = df.drop('Claim Injury Type', axis=1) 
-    y = df['Claim Injury Type']  
+    X = df.drop('Claim Injury Type', axis=1)
+    y = df['Claim Injury Type']
 
     # Split the dataset into training and validation sets
-    X_train, X_val, y_train, y_val = train_test_split(X, y, 
-                                                    test_size=0.2, 
-                                                    random_state=42,
-                                                    stratify = y) 
-
-    ## Feature Engineering
-    #Alternative Dispute Resolution
-    
-    X_train['Alternative Dispute Resolution Enc'] = X_train['Alternative Dispute Resolution'].replace({'N': 0, 'Y': 1, 'U': 1})
-    X_val['Alternative Dispute Resolution Enc'] = X_val['Alternative Dispute Resolution'].replace({'N': 0, 'Y': 1, 'U': 1}) 
-    user_input['Alternative Dispute Resolution Enc'] = user_input['Alternative Dispute Resolution'].replace({'No': 0, 'Yes': 1, 'U': 1})
-    
-    #Attorney/Representative
-    X_train['Attorney/Representative Enc'] = X_train['Attorney/Representative'].replace({'N': 0, 'Y': 1})
-    X_val['Attorney/Representative Enc'] = X_val['Attorney/Representative'].replace({'N': 0, 'Y': 1})
-    user_input['Attorney/Representative Enc'] = user_input['Attorney/Representative'].replace({'No': 0, 'Yes': 1})
-    
-    #Carrier Name
-    train_carriers = set(X_train['Carrier Name'].unique())
-    user_input_carriers = set(user_input['Carrier Name'].unique())
-
-    common_categories = train_carriers.intersection(user_input_carriers)
-    
-    common_category_map = {category: idx + 1 for idx, 
-                       category in enumerate(common_categories)}
-    
-    X_train['Carrier Name'] = X_train['Carrier Name'].map(common_category_map).fillna(0).astype(int)
-    X_val['Carrier Name'] = X_val['Carrier Name'].map(common_category_map).fillna(0).astype(int)
-    user_input['Carrier Name'] = user_input['Carrier Name'].map(common_category_map).fillna(0).astype(int)
-    
-    X_train, X_val, user_input = p.encode(X_train, X_val, user_input, 'Carrier Name', 'count')
-    
-    #Carrier Type
-    X_train, X_val, user_input = p.encode(X_train, X_val, user_input, 'Carrier Type', 'count')
-    #Count Enc
-    X_train, X_val, user_input = p.encode(X_train, X_val, user_input, 'Carrier Type', 'count')
-    #One-Hot-Enc
-    X_train, X_val, user_input = p.encode(X_train, X_val, user_input, 'Carrier Type', 'OHE')
-    
-    #County of Injury
-    X_train, X_val, user_input = p.encode(X_train, X_val, user_input, 'County of Injury', 'count')
-    
-    #Covid-19 Indicator
-    X_train['COVID-19 Indicator Enc'] = X_train['COVID-19 Indicator'].replace({'N': 0, 'Y': 1})
-    X_val['COVID-19 Indicator Enc'] = X_val['COVID-19 Indicator'].replace({'N': 0, 'Y': 1})
-    user_input['COVID-19 Indicator Enc'] = user_input['COVID-19 Indicator'].replace({'No': 0, 'Yes': 1})
-    
-    #District Name 
-    X_train, X_val, user_input = p.encode(X_train, X_val, user_input, 'District Name', 'count')
-    
-    #Gender 
-    X_train, X_val, user_input = p.encode(X_train, X_val, user_input, 'Gender', 'OHE')
-    
-    #Medical Fee Region
-    X_train, X_val, user_input = p.encode(X_train, X_val, user_input, 'Medical Fee Region', 'count')
-    
-    #Industry Sector 
-    X_train, X_val, user_input = p.encode(X_train, X_val, user_input, 'Industry Sector', 'count')
-    
-    #Remove Enc Variables
-    drop = ['Alternative Dispute Resolution', 'Attorney/Representative', 'Carrier Type', 'County of Injury',
-        'COVID-19 Indicator', 'District Name', 'Gender', 'Carrier Name',
-        'Medical Fee Region', 'Industry Sector']
-    
-    X_train.drop(columns = drop, axis = 1, inplace = True)
-    X_val.drop(columns = drop, axis = 1, inplace = True)
-    user_input.drop(columns = drop, axis = 1, inplace = True)
-    
-    ## Missing Values
-    # C_3 Date 
-    X_train['C-3 Date Binary'] = X_train['C-3 Date'].notna().astype(int)
-    X_val['C-3 Date Binary'] = X_val['C-3 Date'].notna().astype(int)
-    user_input['C-3 Date Binary'] = user_input['C-3 Date'].notna().astype(int)
-    
-    # First Hearing Date
-    X_train['First Hearing Date Binary'] = X_train['First Hearing Date'].notna().astype(int)
-    X_val['First Hearing Date Binary'] = X_val['First Hearing Date'].notna().astype(int)
-    user_input['First Hearing Date Binary'] = user_input['First Hearing Date'].notna().astype(int)
-
-    # Remove Transformed date
-    drop = ['C-3 Date', 'First Hearing Date']
-
-    X_train.drop(columns = drop, axis = 1, inplace = True)
-    X_val.drop(columns = drop, axis = 1, inplace = True)
-    user_input.drop(columns = drop, axis = 1, inplace = True)
+    X_train, X_val, y_train, y_val = train_test_split(X, y,
+                                                    test_size=0.2,
+                                                    random_state=random_state,
+                                                    stratify = y)
 
-    # Filling MV
-    # IME-4 Count
-    X_train['IME-4 Count'] = X_train['IME-4 Count'].fillna(0)
-    X_val['IME-4 Count'] = X_val['IME-4 Count'].fillna(0)
-    user_input['IME-4 Count'] = user_input['IME-4 Count'].fillna(0)
+    # Preprocessing (same as the cross-validation with count encoding and outliers treated),
+    # with hashed carriers and zip codes so new claims need no training data to be encoded
+    preprocessor = ClaimsPreprocessor(enc = 'count', outliers = True, hash_buckets = HASH_BUCKETS)
 
-    # Industry Code
-    X_train['Industry Code'] = X_train['Industry Code'].fillna(0)
-    X_val['Industry Code'] = X_val['Industry Code'].fillna(0)
-    user_input['Industry Code'] = user_input['Industry Code'].fillna(0)
-
-    # Accident Date & C-2 Date
-    p.fill_dates(X_train, [X_val, user_input], 'Accident Date')
-    p.fill_dates(X_train, [X_val, user_input], 'C-2 Date')
-
-    p.fill_dow([X_train, X_val, user_input], 'Accident Date')
-    p.fill_dow([X_train, X_val, user_input], 'C-2 Date')
-    
-    # Time Between
-    X_train = p.fill_missing_times(X_train, ['Accident to Assembly Time', 
-                             'Assembly to C-2 Time',
-                             'Accident to C-2 Time'])
+    X_train_RS, y_train = preprocessor.fit_transform(X_train, y_train)
+    X_val_RS = preprocessor.transform(X_val)
 
-    X_val = p.fill_missing_times(X_val, ['Accident to Assembly Time', 
-                             'Assembly to C-2 Time',
-                             'Accident to C-2 Time'])
+    ## Modeling
+    from xgboost import XGBClassifier
 
-    user_input = p.fill_missing_times(user_input, ['Accident to Assembly Time', 
-                             'Assembly to C-2 Time',
-                             'Accident to C-2 Time'])
+    model = XGBClassifier()
+    model.fit(X_train_RS, y_train)
+    val_pred = model.predict(X_val_RS)
 
-    # Birth Year
-    p.fill_birth_year([X_train, X_val, user_input])
+    artifact = {
+        'version': ARTIFACT_VERSION,
+        'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'preprocessor': preprocessor,
+        'columns': list(X_train_RS.columns),
+        'model': model,
+        'label_mapping': label_mapping,
+        'val_macro_f1': f1_score(y_val, val_pred, average='macro')
+    }
 
-    ## Scalling
-    # Variable Type Split
-    num = ['Age at Injury', 'Average Weekly Wage', 'Birth Year',
-       'IME-4 Count', 'Number of Dependents', 'Accident Date Year',
-       'Accident Date Month', 'Accident Date Day', 
-       'Assembly Date Year', 'Assembly Date Month', 
-       'Assembly Date Day', 'C-2 Date Year', 'C-2 Date Month',
-       'C-2 Date Day', 'Accident to Assembly Time',
-       'Assembly to C-2 Time', 'Accident to C-2 Time']
-      # 'Wage to Age Ratio', 'Average Weekly Wage Sqrt',
-      # 'IME-4 Count Log', 'IME-4 Count Double Log']
+    # Written to a temporary file first, so readers never see a partial artifact
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(artifact_path)), suffix='.tmp')
 
- 
-    categ = [var for var in X_train.columns if var not in num]
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as f:
+            pickle.dump(artifact, f)
+        os.replace(tmp_path, artifact_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
-    categ_count_encoding = ['Carrier Name Enc', 'Carrier Type Enc',
-                        'County of Injury Enc', 'District Name Enc',
-                        'Medical Fee Region Enc', 'Industry Sector Enc']
+    return artifact
 
 
-    categ_label_bin = [var for var in X_train.columns if var
-                   in categ and var not in categ_count_encoding]
+## SERVING
 
+def read_artifact(artifact_path = ARTIFACT_PATH):
 
-    # Scaling
-    num_count_enc = num + categ_count_encoding
-    robust = RobustScaler()
+    """
+    Input:
+        artifact_path: path to the fitted artifact
 
-    # Scaling the numerical features in the training set using RobustScaler
-    X_train_num_count_enc_RS = robust.fit_transform(X_train[num_count_enc])
-    X_train_num_count_enc_RS = pd.DataFrame(X_train_num_count_enc_RS, columns=num_count_enc, index=X_train.index)
+    Output: fitted artifact
+    """
 
-    # Scaling the numerical features in the validation set using the fitted RobustScaler
-    X_val_num_count_enc_RS = robust.transform(X_val[num_count_enc])
-    X_val_num_count_enc_RS = pd.DataFrame(X_val_num_count_enc_RS, columns=num_count_enc, index=X_val.index)
+    require_artifact(artifact_path)
 
-    # Scaling the numerical features in the user_input set using the same fitted RobustScaler
-    user_input_num_count_enc_RS = robust.transform(user_input[num_count_enc])
-    user_input_num_count_enc_RS = pd.DataFrame(user_input_num_count_enc_RS, columns=num_count_enc, index=user_input.index)
+    with gzip.open(artifact_path, 'rb') as f:
+        artifact = pickle.load(f)
 
-    # Joining Features
-    X_train_RS = pd.concat([X_train_num_count_enc_RS, 
-                        X_train[categ_label_bin]], axis=1)
-    X_val_RS = pd.concat([X_val_num_count_enc_RS, 
-                      X_val[categ_label_bin]], axis=1)
-    user_input_RS = pd.concat([user_input_num_count_enc_RS, 
-                     user_input[categ_label_bin]], axis=1)
+    if artifact.get('version') != ARTIFACT_VERSION:
+        raise ValueError(f"Artifact version {artifact.get('version')} does not match "
+                         f"version {ARTIFACT_VERSION}, run `python preproc.py` to refit it")
 
-    # Countinuing MV
+    return artifact
 
-    #Average Weekly Wage
-    p.ball_tree_impute([X_train_RS, X_val_RS], 
-                   'Average Weekly Wage')
-    
-    ## Outliers 
 
-    #Avg Weekly Wage
-    # Square Root 
-    X_train_RS['Average Weekly Wage Sqrt'] = np.sqrt(X_train_RS['Average Weekly Wage'])
+def require_artifact(artifact_path = ARTIFACT_PATH):
 
-    X_val_RS['Average Weekly Wage Sqrt'] = np.sqrt(X_val_RS['Average Weekly Wage'])
+    """
+    Input:
+        artifact_path: path to the fitted artifact
 
-    user_input_RS['Average Weekly Wage Sqrt'] = np.sqrt(user_input_RS['Average Weekly Wage'])
+    Output: None, raises FileNotFoundError if the artifact has not been fitted (it is fitted
+            offline, never inside a request)
+    """
 
-    # Winsorization
-    upper_limit = X_train['Average Weekly Wage'].quantile(0.99)
-    lower_limit = X_train['Average Weekly Wage'].quantile(0.01)
+    if not os.path.exists(artifact_path):
+        raise FileNotFoundError(f"No fitted artifact at {artifact_path}, "
+                                f"run `python preproc.py` to fit the artifact")
 
-    X_train_RS['Average Weekly Wage'] = X_train_RS['Average Weekly Wage'].clip(lower = lower_limit
-                                                                  , upper=upper_limit)
-    # Birth Year
 
-    # IME-4 Count
-    X_train_RS['IME-4 Count Log'] = np.log1p(X_train_RS['IME-4 Count'])
-    X_train_RS['IME-4 Count Double Log'] = np.log1p(X_train_RS['IME-4 Count Log'])
+def artifact_id(artifact_path = ARTIFACT_PATH):
 
-    X_val_RS['IME-4 Count Log'] = np.log1p(X_val_RS['IME-4 Count'])
-    X_val_RS['IME-4 Count Double Log'] = np.log1p(X_val_RS['IME-4 Count Log'])
+    """
+    Input:
+        artifact_path: path to the fitted artifact
 
-    user_input_RS['IME-4 Count Log'] = np.log1p(user_input_RS['IME-4 Count'])
-    user_input_RS['IME-4 Count Double Log'] = np.log1p(user_input_RS['IME-4 Count Log'])
+    Output: id of the artifact on disk (version and modification time), changes whenever it is refit
+    """
 
-    # Accident Date Year
+    require_artifact(artifact_path)
 
+    return f"v{ARTIFACT_VERSION}-{os.stat(artifact_path).st_mtime_ns}"
 
-    # C-2 Date Year
-    
 
-    #Alternative Dispute Resolution Enc --> it will prob be dropeed
-    # Ensuring y_train as the same indices as Y_train
-    y_train = y_train[X_train_RS.index]
+@st.cache_resource(max_entries=1)
+def _load_artifact(artifact_path, model_id):
+    return read_artifact(artifact_path)
 
-    ## Modeling 
-    st.write('The model is being trained...')
-    st.write('This will take a few (3-4) minutes')
 
-    ## Modeling
-    model = XGBClassifier()
-    model.fit(X_train_RS, y_train)
-    train_pred = model.predict(X_train_RS)
-    val_pred = model.predict(X_val_RS)
+def load_artifact(artifact_path = ARTIFACT_PATH):
+    # Loaded once per server and shared by every session (reloaded if the artifact is refit)
+    return _load_artifact(artifact_path, artifact_id(artifact_path))
+
+
+def predict_batch(user_input, artifact = None, progress = None):
 
-    ## Final Predictions
+    """
+    Inputs:
+        user_input: raw claims (one row per claim), indexed by Claim Identifier
+        artifact: fitted artifact (loaded once if None)
+        progress: optional callback, called with the name of each stage
 
-    test_filtered = user_input_RS
+    Output: dataframe with the predicted Claim Injury Type and the probability of each class
+    """
 
-    test_filtered['Claim Injury Type'] = model.predict(test_filtered)
+    if artifact is None:
+        artifact = load_artifact()
+
+    with stage('engineer features'):
+        user_input = engineer_features(user_input.copy())
+
+    with stage('preprocess'):
+        user_input_RS = artifact['preprocessor'].transform(user_input, progress=progress)
+        user_input_RS = user_input_RS[artifact['columns']]
+
+    # Predictions for every claim in one pass
+    if progress is not None:
+        progress('predict')
+    with stage('predict_proba'):
+        probas = artifact['model'].predict_proba(user_input_RS)
+    classes = artifact['model'].classes_
+
+    predictions = pd.DataFrame(probas, index=user_input_RS.index,
+                               columns=[f"P({artifact['label_mapping'][c]})" for c in classes])
 
     #Map Predictions to Original Values
+    predictions.insert(0, 'Claim Injury Type',
+                       [artifact['label_mapping'][c] for c in classes[probas.argmax(axis=1)]])
 
-    label_mapping = {
-        0: "1. CANCELLED",
-        1: "2. NON-COMP",
-        2: "3. MED ONLY",
-        3: "4. TEMPORARY",
-        4: "5. PPD SCH LOSS",
-        5: "6. PPD NSL",
-        6: "7. PTD",
-        7: "8. DEATH"   
-    }
+    return predictions
+
+
+# The predictor of the previous artifact stops its worker thread when it is replaced
+@st.cache_resource(max_entries=1, on_release=lambda predictor: predictor.close())
+def _get_predictor(model_id):
+    artifact = load_artifact()
+    return serving.Predictor(lambda claims, progress: predict_batch(claims, artifact, progress))
+
+
+def get_predictor():
+    # One predictor per server, read-only and shared by every session
+    return _get_predictor(artifact_id())
+
+
+def predict_claim(user_input, progress = None, use_shared_predictor = True):
+
+    """
+    Inputs:
+        user_input: claim as a DataFrame or a dict of typed fields (dates as datetime64),
+                    or the path to a CSV file with claims
+        progress: optional callback, called with the name of each stage
+                  (load, encode, scale, impute, predict)
+        use_shared_predictor: True to go through the shared predictor (batched with concurrent requests),
+                              False to predict in the calling thread
+
+    Output: predicted Claim Injury Type and class probabilities of the first claim
+    """
+
+    if progress is None:
+        progress = lambda stage: None
+
+    progress('load')
+
+    if isinstance(user_input, dict):
+        user_input = pd.DataFrame(user_input, index=[0])
+    elif isinstance(user_input, str):
+        user_input = pd.read_csv(user_input)
+
+    if 'Claim Identifier' in user_input.columns:
+        user_input = user_input.set_index('Claim Identifier')
+
+    # The artifact is fitted offline (python preproc.py)
+    require_artifact()
+
+    # Concurrent requests are coalesced into one batch by the shared predictor
+    if use_shared_predictor:
+        predictions = get_predictor().predict(user_input, progress=progress)
+    else:
+        predictions = predict_batch(user_input, load_artifact(), progress)
+
+    return predictions.iloc[0]
+
+
+def preproc_(user_input, progress = None, profile = False):
+
+    """
+    Inputs:
+        user_input: claim as a DataFrame or a dict of typed fields (dates as datetime64),
+                    or the path to a CSV file with claims
+        progress: optional callback, called with the name of each stage
+        profile: True to time and sample the peak memory of every stage,
+                 'cprofile' to also capture a cProfile
+
+    Output: predicted Claim Injury Type of the first claim
+            (and the stage profile, see profiler.StageProfiler.to_dict, if profile)
+    """
+
+    if not profile:
+        return predict_claim(user_input, progress)['Claim Injury Type']
+
+    # Profiled in this thread, without the shared predictor
+    with StageProfiler(cprofile = (profile == 'cprofile')) as profiler:
+        with stage('predict claim'):
+            predicted_label = predict_claim(user_input, progress, use_shared_predictor = False)['Claim Injury Type']
 
-    test_filtered['Claim Injury Type'] = test_filtered['Claim Injury Type'].replace(label_mapping)
-    predicted_label = test_filtered['Claim Injury Type'].iloc[0]
-    
-    return predicted_label
+    return predicted_label, profiler.to_dict()
 
 
+if __name__ == '__main__':
 
+    import argparse
 
+    parser = argparse.ArgumentParser(description='Fit the preprocessing and model used by the web app')
+    parser.add_argument('--train', default=TRAIN_PATH, help='path to train_data_EDA.csv')
+    parser.add_argument('--out', default=ARTIFACT_PATH, help='path of the fitted artifact')
+    args = parser.parse_args()
 
+    artifact = fit_artifact(args.train, args.out)
+    print(f"Saved artifact v{artifact['version']} to {args.out} "
+          f"(validation macro F1: {artifact['val_macro_f1']:.4f})")
@@ -0,0 +1,152 @@
+"""
+Headless batch scoring of a claims CSV with the fitted artifact.
+
+    python score.py claims.csv predictions.csv --chunksize 50000 --workers 4
+    python score.py claims.csv predictions.parquet
+
+The input is streamed in chunks, each chunk is scored in a process pool (the artifact is
+loaded once per worker, nothing is refit) and the predictions are written as soon as
+they are ready, so memory stays bounded whatever the size of the input.
+"""
+
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import preproc as p
+
+
+# Artifact of each worker process
+_artifact = None
+
+
+def init_worker(artifact_path, n_threads = 1):
+    global _artifact
+    _artifact = p.read_artifact(artifact_path)
+
+    # The cores are divided between the workers, instead of every model using all of them
+    _artifact['model'].set_params(n_jobs=n_threads)
+
+
+def score_chunk(chunk):
+
+    """
+    Input:
+        chunk: dataframe of raw claims
+
+    Output: predicted Claim Injury Type and class probabilities of the chunk
+    """
+
+    if 'Claim Identifier' in chunk.columns:
+        chunk = chunk.set_index('Claim Identifier')
+
+    return p.predict_batch(chunk, _artifact)
+
+
+class PredictionWriter:
+
+    """
+    Appends predictions to a CSV or Parquet file, one chunk at a time.
+
+    Input:
+        path: output file (.parquet for Parquet, CSV otherwise)
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        self.parquet = path.endswith('.parquet')
+        self._writer = None
+        self._first = True
+
+    def write(self, predictions):
+
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(predictions, preserve_index=True)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table.cast(self._writer.schema))
+        else:
+            predictions.to_csv(self.path, mode='w' if self._first else 'a', header=self._first)
+
+        self._first = False
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def score_file(input_path, output_path, artifact_path = p.ARTIFACT_PATH,
+               chunksize = 50000, workers = None):
+
+    """
+    Inputs:
+        input_path: CSV with raw claims (same fields as the form of the web app)
+        output_path: CSV or Parquet file for the predictions
+        artifact_path: fitted artifact
+        chunksize: rows per chunk
+        workers: number of processes (defaults to the number of cores), the cores are divided
+                 between them for the model
+
+    Output: dictionary with the number of rows, the elapsed time and the rows/second
+    """
+
+    workers = workers or os.cpu_count()
+    writer = PredictionWriter(output_path)
+
+    start_time = time.perf_counter()
+    n_rows = 0
+
+    # At most two chunks per worker are in memory at any time
+    max_in_flight = 2 * workers
+    in_flight = deque()
+
+    # Threads of the model in each worker
+    n_threads = max(1, (os.cpu_count() or 1) // workers)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(artifact_path, n_threads)) as executor:
+        try:
+            for chunk in pd.read_csv(input_path, chunksize=chunksize):
+                in_flight.append(executor.submit(score_chunk, chunk))
+
+                # Chunks are written in input order
+                if len(in_flight) >= max_in_flight:
+                    predictions = in_flight.popleft().result()
+                    writer.write(predictions)
+                    n_rows += len(predictions)
+
+            while in_flight:
+                predictions = in_flight.popleft().result()
+                writer.write(predictions)
+                n_rows += len(predictions)
+        finally:
+            writer.close()
+
+    elapsed_time = time.perf_counter() - start_time
+
+    return {'rows': n_rows,
+            'seconds': elapsed_time,
+            'rows_per_second': n_rows / max(elapsed_time, 1e-9)}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Score a claims CSV with the fitted artifact')
+    parser.add_argument('input', help='CSV with the claims to score')
+    parser.add_argument('output', help='output file (.csv or .parquet)')
+    parser.add_argument('--artifact', default=p.ARTIFACT_PATH, help='path of the fitted artifact')
+    parser.add_argument('--chunksize', type=int, default=50000, help='rows per chunk')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes')
+    args = parser.parse_args()
+
+    summary = score_file(args.input, args.output, args.artifact, args.chunksize, args.workers)
+    print(f"Scored {summary['rows']:,} claims in {summary['seconds']:.1f} seconds "
+          f"({summary['rows_per_second']:,.0f} rows/second)")
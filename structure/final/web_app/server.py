@@ -0,0 +1,332 @@
+"""
+Local HTTP scoring service for the claim classifier.
+
+    python server.py --host 127.0.0.1 --port 8000
+
+Endpoints:
+    POST /predict   one claim (JSON object) or many claims (JSON list or {"claims": [...]}),
+                    with the same fields as the form of the web app
+    GET  /metrics   request and claim counts, throughput, p50/p95/p99 latency and batch sizes
+    GET  /health    status and id of the loaded artifact
+
+Requests are queued and a batcher scores them together (dynamic micro-batching), with the
+preprocessing of preproc.py and an artifact loaded once at startup.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+import preproc as p
+
+
+class Metrics:
+
+    """
+    Latency and throughput counters of the service.
+
+    Input:
+        window: number of recent requests used for the latency percentiles
+    """
+
+    def __init__(self, window = 10000):
+
+        self.started_at = time.monotonic()
+        self.requests = 0
+        self.claims = 0
+        self.errors = 0
+        self.batches = 0
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+
+    def record_request(self, n_claims, latency):
+        self.requests += 1
+        self.claims += n_claims
+        self.latencies.append(latency)
+
+    def record_batch(self, n_claims):
+        self.batches += 1
+        self.batch_sizes.append(n_claims)
+
+    def summary(self):
+
+        uptime = time.monotonic() - self.started_at
+        latencies = np.array(self.latencies) * 1000
+
+        summary = {
+            'uptime_seconds': round(uptime, 1),
+            'requests': self.requests,
+            'claims': self.claims,
+            'errors': self.errors,
+            'batches': self.batches,
+            'requests_per_second': round(self.requests / uptime, 2),
+            'claims_per_second': round(self.claims / uptime, 2),
+            'avg_batch_size': round(float(np.mean(self.batch_sizes)), 2) if self.batch_sizes else 0
+        }
+
+        for q in (50, 95, 99):
+            summary[f'p{q}_latency_ms'] = round(float(np.percentile(latencies, q)), 2) if len(latencies) else None
+
+        return summary
+
+
+class ScoringService:
+
+    """
+    Scores claims in micro-batches: requests wait in a queue and are scored together
+    once max_batch_size claims are waiting or max_wait seconds have passed.
+
+    Inputs:
+        artifact: fitted artifact (see preproc.fit_artifact)
+        max_batch_size: maximum number of claims per batch
+        max_wait: seconds to wait for more requests after the first one
+    """
+
+    def __init__(self, artifact, max_batch_size = 256, max_wait = 0.01):
+
+        self.artifact = artifact
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.metrics = Metrics()
+
+        self._queue = asyncio.Queue()
+
+    async def predict(self, claims):
+
+        """
+        Input:
+            claims: dataframe with one or more claims
+
+        Output: predictions of the claims
+        """
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((claims, future))
+
+        return await future
+
+    async def run_batcher(self):
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self._queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+
+            # Collect more requests until the batch is full or the wait is over
+            while size < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(request)
+                size += len(request[0])
+
+            self.metrics.record_batch(size)
+
+            # The model runs in a thread so the event loop keeps accepting requests
+            try:
+                claims = pd.concat([request[0] for request in batch])
+                predictions = await loop.run_in_executor(None, p.predict_batch, claims, self.artifact)
+            except Exception as error:
+                # Score each request alone so one bad claim does not fail the others
+                for request_claims, future in batch:
+                    try:
+                        result = error if len(batch) == 1 else \
+                            await loop.run_in_executor(None, p.predict_batch, request_claims, self.artifact)
+                    except Exception as request_error:
+                        result = request_error
+
+                    if not future.done():
+                        if isinstance(result, Exception):
+                            future.set_exception(result)
+                        else:
+                            future.set_result(result)
+                continue
+
+            start = 0
+            for request_claims, future in batch:
+                end = start + len(request_claims)
+                if not future.done():
+                    future.set_result(predictions.iloc[start:end])
+                start = end
+
+
+def to_claims(payload):
+
+    """
+    Input:
+        payload: decoded JSON body (object, list of objects or {"claims": [...]})
+
+    Output: dataframe of claims, indexed by Claim Identifier when given
+    """
+
+    if isinstance(payload, dict) and 'claims' in payload:
+        payload = payload['claims']
+    if isinstance(payload, dict):
+        payload = [payload]
+
+    if not isinstance(payload, list) or not payload:
+        raise ValueError('Expected a claim object or a non-empty list of claims')
+
+    if not all(isinstance(claim, dict) for claim in payload):
+        raise ValueError('Each claim must be a JSON object')
+
+    claims = pd.DataFrame(payload)
+    if 'Claim Identifier' in claims.columns:
+        claims = claims.set_index('Claim Identifier')
+
+    # Checked per request, so a claim is rejected alone or batched with others
+    missing = p.missing_columns(claims)
+    if missing:
+        raise ValueError(f"Missing fields: {', '.join(missing)}")
+
+    return claims
+
+
+def to_records(predictions):
+
+    # Claim Identifier (or position) plus label and probabilities
+    records = predictions.reset_index().rename(columns={'index': 'Claim Identifier'})
+    return json.loads(records.to_json(orient='records'))
+
+
+async def read_request(reader):
+
+    """
+    Input:
+        reader: stream of the connection
+
+    Output: method, path, headers and body of the next HTTP request (None if the connection closed)
+    """
+
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+
+    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+    return method, path, headers, body
+
+
+def http_response(status, payload, keep_alive):
+
+    reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+    body = json.dumps(payload).encode('utf-8')
+
+    head = (f"HTTP/1.1 {status} {reasons[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+
+    return head.encode('latin-1') + body
+
+
+async def handle(service, model_id, method, path, body):
+
+    """
+    Inputs:
+        service: scoring service
+        model_id: id of the loaded artifact
+        method, path, body: HTTP request
+
+    Output: status code and JSON payload
+    """
+
+    if method == 'GET' and path == '/health':
+        return 200, {'status': 'ok', 'model_id': model_id}
+
+    if method == 'GET' and path == '/metrics':
+        return 200, service.metrics.summary()
+
+    if method == 'POST' and path == '/predict':
+        start_time = time.perf_counter()
+
+        # Malformed bodies and claims are client errors
+        try:
+            claims = to_claims(json.loads(body or b'null'))
+        except (KeyError, TypeError, ValueError) as error:
+            service.metrics.errors += 1
+            return 400, {'error': str(error)}
+
+        try:
+            predictions = await service.predict(claims)
+        except Exception as error:
+            service.metrics.errors += 1
+            return 500, {'error': f'{type(error).__name__}: {error}'}
+
+        service.metrics.record_request(len(claims), time.perf_counter() - start_time)
+
+        return 200, {'model_id': model_id, 'predictions': to_records(predictions)}
+
+    return 404, {'error': f'{method} {path} not found'}
+
+
+async def serve(host, port, artifact_path, max_batch_size, max_wait):
+
+    artifact = p.read_artifact(artifact_path)
+    model_id = p.artifact_id(artifact_path)
+    service = ScoringService(artifact, max_batch_size, max_wait)
+
+    async def on_connection(reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+
+                status, payload = await handle(service, model_id, method, path.split('?')[0], body)
+                writer.write(http_response(status, payload, keep_alive))
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    batcher = asyncio.create_task(service.run_batcher())
+    server = await asyncio.start_server(on_connection, host, port)
+
+    print(f"Serving artifact {model_id} on http://{host}:{port}")
+    async with server:
+        try:
+            await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Local HTTP scoring service for the claim classifier')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--artifact', default=p.ARTIFACT_PATH, help='path of the fitted artifact')
+    parser.add_argument('--max-batch-size', type=int, default=256, help='maximum claims per micro-batch')
+    parser.add_argument('--max-wait', type=float, default=0.01, help='seconds to wait to fill a micro-batch')
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.host, args.port, args.artifact, args.max_batch_size, args.max_wait))
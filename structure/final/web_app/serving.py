@@ -0,0 +1,137 @@
+import queue
+import threading
+import time
+import pandas as pd
+
+
+class Predictor:
+
+    """
+    Process-wide predictor shared by every session.
+
+    Requests from concurrent threads are queued and a single worker thread coalesces
+    them into micro-batches, so the model is called once per batch instead of once per claim.
+
+    Inputs:
+        predict_fn: function called as predict_fn(claims, progress) that scores a dataframe
+                    of claims and returns one row per claim
+        max_batch_size: maximum number of claims per batch
+        max_wait: seconds to wait for more requests after the first one arrives
+    """
+
+    def __init__(self, predict_fn, max_batch_size = 64, max_wait = 0.005):
+
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name='predictor', daemon=True)
+        self._worker.start()
+
+    def predict(self, claims, timeout = None, progress = None):
+
+        """
+        Inputs:
+            claims: dataframe with one or more claims
+            timeout: seconds to wait for the result (None waits forever)
+            progress: optional callback, called with the name of each stage of the batch
+
+        Output: predictions for the claims, in the same order
+        """
+
+        request = {'claims': claims, 'progress': progress,
+                   'done': threading.Event(), 'result': None, 'error': None}
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Predictor is closed')
+            self._queue.put(request)
+
+        if not request['done'].wait(timeout):
+            raise TimeoutError('Prediction did not finish in time')
+        if request['error'] is not None:
+            raise request['error']
+
+        return request['result']
+
+    def close(self):
+
+        """
+        Stops the worker thread once the queued requests are scored (new requests are refused).
+        """
+
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+
+    def _next_batch(self):
+
+        # Block for the first request, then collect until the batch is full or the wait is over
+        # (empty batch once the predictor is closed)
+        request = self._queue.get()
+        if request is None:
+            return []
+
+        batch = [request]
+        size = len(batch[0]['claims'])
+        deadline = time.monotonic() + self.max_wait
+
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                # Closed: this batch is the last one
+                self._queue.put(None)
+                break
+            batch.append(request)
+            size += len(request['claims'])
+
+        return batch
+
+    def _run(self):
+
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+
+            # Every request in the batch sees the stages of the batch
+            callbacks = [request['progress'] for request in batch if request['progress'] is not None]
+
+            def progress(stage):
+                for callback in callbacks:
+                    callback(stage)
+
+            try:
+                predictions = self.predict_fn(pd.concat([request['claims'] for request in batch]), progress)
+
+                # Split the batch back by position (claim identifiers may repeat across requests)
+                start = 0
+                for request in batch:
+                    end = start + len(request['claims'])
+                    request['result'] = predictions.iloc[start:end]
+                    start = end
+
+            except Exception as error:
+                if len(batch) == 1:
+                    batch[0]['error'] = error
+
+                # Score each request alone so one bad claim does not fail the others
+                for request in batch[len(batch) == 1:]:
+                    try:
+                        request['result'] = self.predict_fn(request['claims'], request['progress'])
+                    except Exception as request_error:
+                        request['error'] = request_error
+
+            for request in batch:
+                request['done'].set()
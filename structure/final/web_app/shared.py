@@ -0,0 +1,10 @@
+import os
+import sys
+
+
+# Modules shared with the cross-validation (pipeline, utils2, profiler, dates) have a single copy in ../main.
+# It is appended to the path, so the web app's own modules (utils, models) still come first.
+MAIN_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+if MAIN_DIR not in sys.path:
+    sys.path.append(MAIN_DIR)